@@ -17,6 +17,20 @@ CREATE TABLE "LANDING_LAYER".appointments (
     UPDT_DB_TS TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+--LND_to_CORE reads the landing table in this order, and resumes after a PatientId
+CREATE INDEX idx_landing_patient ON "LANDING_LAYER".appointments (PatientId, AppointmentID);
+
+--Load manifest: one row per source file loaded into the landing layer
+CREATE TABLE "LANDING_LAYER".load_manifest (
+    FileHash CHAR(64) PRIMARY KEY, -- SHA-256 of the file content
+    FileName VARCHAR(255) NOT NULL,
+    RowsLoaded INTEGER NOT NULL DEFAULT 0,
+    RowsRejected INTEGER NOT NULL DEFAULT 0,
+    LoadMode VARCHAR(16) NOT NULL, -- truncate / append
+    Status VARCHAR(16) NOT NULL, -- LOADED / FAILED
+    LoadedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 --Target Table defintiton
 CREATE TABLE "FINAL_LAYER".pat_attendance_core (
     PatientId NUMERIC NOT NULL,
@@ -38,8 +52,75 @@ CREATE TABLE "FINAL_LAYER".pat_attendance_core (
     IsActive BOOLEAN NOT NULL DEFAULT TRUE, -- Indicates if this is the current active record
     CR_DB_TS TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Created timestamp
     UPDT_DB_TS TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Updated timestamp
+    RowHash CHAR(32), -- MD5 of the tracked attributes, compared to detect a change
     PRIMARY KEY (AppointmentID, RecordStartDate) -- Composite Key for SCD
 );
 
 CREATE INDEX idx_patientid ON "FINAL_LAYER".pat_attendance_core (PatientId);
 CREATE INDEX idx_isactive ON "FINAL_LAYER".pat_attendance_core (IsActive);
+CREATE INDEX idx_active_rowhash ON "FINAL_LAYER".pat_attendance_core (PatientId, RowHash) WHERE IsActive;
+--Current version of every patient, in the order the API's /snapshot pages through it
+CREATE INDEX idx_current_patient ON "FINAL_LAYER".pat_attendance_core (PatientId, AppointmentID) WHERE IsActive;
+
+--ETL checkpoint: progress of the LND_to_CORE job, used to resume an interrupted run
+CREATE TABLE "FINAL_LAYER".etl_checkpoint (
+    JobName VARCHAR(64) PRIMARY KEY,
+    LastPatientId NUMERIC, -- Last patient committed (NULL before the first commit)
+    LastAppointmentID BIGINT, -- Last appointment of that patient
+    PatientsProcessed BIGINT NOT NULL DEFAULT 0,
+    RowsProcessed BIGINT NOT NULL DEFAULT 0,
+    Status VARCHAR(16) NOT NULL, -- RUNNING / COMPLETE
+    LandingLoad TEXT, -- Landing rows the run reads (row count and latest CR_DB_TS); a run resumes only over the same load
+    StartedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UPDT_DB_TS TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+--Load generation: bumped by LND_to_CORE in every transaction that changes a table, so the API
+--can tell with one lookup whether cached results of that table are still current
+CREATE TABLE "FINAL_LAYER".load_generation (
+    SchemaName VARCHAR(63) NOT NULL,
+    TableName VARCHAR(63) NOT NULL,
+    Generation BIGINT NOT NULL DEFAULT 0,
+    UPDT_DB_TS TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (SchemaName, TableName)
+);
+
+--Summary of every appointment, at its latest version, at the grain of every dimension the API's /aggregate
+--groups by, with additive measures so any coarser grouping is a SUM over it. The active rows alone would
+--hold one appointment per patient (the latest). Refreshed by LND_to_CORE after each load; AgeBand must
+--match AGE_BAND_SQL in aggregates.py, and the appointments must match current_rows_sql
+CREATE MATERIALIZED VIEW "FINAL_LAYER".pat_attendance_summary AS
+SELECT Neighbourhood,
+       Gender,
+       CASE WHEN Age < 18 THEN '0-17' WHEN Age < 35 THEN '18-34' WHEN Age < 50 THEN '35-49'
+            WHEN Age < 65 THEN '50-64' ELSE '65+' END AS AgeBand,
+       SMSReceivedStatus,
+       ScholarshipStatus,
+       HipertensionStatus,
+       DiabetesStatus,
+       AlcoholismStatus,
+       HandcapStatus,
+       COUNT(*) AS Appointments,
+       COUNT(*) FILTER (WHERE NoShow) AS NoShows,
+       SUM(Age) AS AgeSum
+FROM (
+    SELECT DISTINCT ON (AppointmentID) *
+    FROM "FINAL_LAYER".pat_attendance_core
+    ORDER BY AppointmentID, RecordStartDate DESC
+) latest_appointments
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9;
+
+--Needed to refresh the summary CONCURRENTLY, without blocking readers
+CREATE UNIQUE INDEX idx_summary_grain ON "FINAL_LAYER".pat_attendance_summary (
+    Neighbourhood, Gender, AgeBand, SMSReceivedStatus, ScholarshipStatus,
+    HipertensionStatus, DiabetesStatus, AlcoholismStatus, HandcapStatus
+);
+
+--Upgrade of a core database created before RowHash existed; fill the column afterwards with
+--python LND_to_CORE/LND_to_CORE.py --backfill-row-hash
+ALTER TABLE "FINAL_LAYER".pat_attendance_core ADD COLUMN IF NOT EXISTS RowHash CHAR(32);
+CREATE INDEX IF NOT EXISTS idx_active_rowhash ON "FINAL_LAYER".pat_attendance_core (PatientId, RowHash) WHERE IsActive;
+--Upgrade of a summary built from the active rows only: DROP MATERIALIZED VIEW "FINAL_LAYER".pat_attendance_summary,
+--then run its CREATE MATERIALIZED VIEW and CREATE UNIQUE INDEX above again
+--Upgrade of a core database created before the checkpoint recorded the landing load it covers
+ALTER TABLE "FINAL_LAYER".etl_checkpoint ADD COLUMN IF NOT EXISTS LandingLoad TEXT;
@@ -1,53 +1,387 @@
+import argparse
+import itertools
+from collections import OrderedDict
+import math
 import os
+import pickle
+import re
+import sys
+import tempfile
+import numpy as np
 import pandas as pd
 
+# Make the shared modules in the repository root importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import appointments_schema
+
 # Path to input CSV file
 INPUT_FILE = "/home/starlord/Subhasis_Tasks/postGreSQL-DataPipeLine-API/Src_to_LND/Archive_Path/KaggleV2-May-2016.csv"  # Replace with the path to your source CSV file
 
 # Output directory for segregated files
 OUTPUT_DIR = "/home/starlord/Subhasis_Tasks/postGreSQL-DataPipeLine-API/File segregator"  # Replace with the desired output directory
 
-def segregate_by_days(input_file, output_dir):
+# Memory the segregation may use on top of the interpreter and pandas, in bytes. None loads and sorts
+# the whole file in memory; with a limit, files whose DataFrame would not fit are segregated out of
+# core (see segregate_out_of_core)
+MEMORY_LIMIT = None
+
+# Peak memory of parsing, sorting and writing out a DataFrame, as a multiple of the DataFrame itself
+# (parsing goes through a Python object per text value, and to_csv through formatted copies)
+MEMORY_OVERHEAD = 8
+
+# Rows read up front to estimate the in-memory and on-disk size of a record
+SIZING_ROWS = 10000
+
+# PatientIds kept to choose the boundaries of the out-of-core partitions
+BOUNDARY_SAMPLE_ROWS = 100000
+
+# Format of the Day files: "csv" (Day_N.csv), or typed binary partitions the landing loader reads
+# without parsing: "parquet" (Day_N.parquet) and "arrow" (Day_N.arrow, Arrow IPC file); both need pyarrow
+OUTPUT_FORMAT = "csv"
+OUTPUT_FORMATS = ["csv", "parquet", "arrow"]
+
+# Buffer of every CSV Day file
+WRITE_BUFFER = 64 * 1024
+
+# Spill files of the out-of-core mode kept open at once; the others are closed and reopened for appending,
+# so a source split into hundreds of partitions stays well below the open file limit
+SPILL_OPEN_FILES = 64
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def day_numbers(df):
     """
-    Segregate patient records into Day 1, Day 2, etc., files based on PatientID and AppointmentID.
+    Day of every record of a frame sorted by PatientId and AppointmentID: its rank within its patient, from 1.
+    """
+    return df.groupby("PatientId", sort=False).cumcount().to_numpy() + 1
+
+
+def split_by(df, keys):
+    """
+    Yield (key, rows of df with that key) for every distinct value of the integer array keys, in
+    increasing key order; a stable sort keeps each group's rows in the frame's order.
+    """
+    order = np.argsort(keys, kind="stable")
+    grouped = df.take(order)
+    keys = keys[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.append(starts[1:], len(keys))
+    for start, end in zip(starts, ends):
+        if start < end:
+            yield int(keys[start]), grouped.iloc[start:end]
+
+
+def day_frames(df):
+    """
+    Yield (day, records of that day) for a frame sorted by PatientId and AppointmentID, by increasing day,
+    each day's records in the frame's order.
+    """
+    # Each day is one contiguous slice of the frame reordered by day number
+    return split_by(df, day_numbers(df))
+
+
+def write_day_files(df, output_dir, output_format=OUTPUT_FORMAT):
+    """
+    Write the records of a frame sorted by PatientId and AppointmentID to one Day file per day number,
+    each file in the frame's order.
+    """
+    writers = DayWriters(output_dir, output_format)
+    try:
+        for day, day_df in day_frames(df):
+            writers.write(day, day_df)
+    finally:
+        writers.close()
+
+
+def require_pyarrow():
+    """
+    Import pyarrow, which is only needed for the parquet and arrow formats.
+    Raises ImportError when it is not installed.
+    """
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pyarrow
+
+
+class DayWriters:
+    """
+    Day files written a frame at a time: the first frame of a day creates its file, later ones are
+    appended. CSV files go through buffered file objects and get the header once; Parquet and Arrow
+    files get the declared types of the feed (appointments_schema.typed): timestamp[us] timestamps and
+    int32/int64 integers, nullable. Every frame becomes a row group or record batch.
+    """
+
+    def __init__(self, output_dir, output_format=OUTPUT_FORMAT, buffer_size=WRITE_BUFFER):
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.buffer_size = buffer_size
+        self.files = {}
+        self.schemas = {}
+        self.pa = None if output_format == "csv" else require_pyarrow()
+
+    def day_file_path(self, day):
+        return os.path.join(self.output_dir, f"Day_{day}.{self.output_format}")
+
+    def write(self, day, day_df):
+        day_file = self.files.get(day)
+        if self.output_format == "csv":
+            header = day_file is None
+            if header:
+                # newline="" leaves line endings to to_csv, as when it is given a path
+                day_file = self.files[day] = open(self.day_file_path(day), "w", newline="", encoding="utf-8",
+                                                  buffering=self.buffer_size)
+            day_df.to_csv(day_file, index=False, header=header)
+            return
+
+        pa = self.pa
+        table = pa.Table.from_pandas(appointments_schema.typed(day_df), schema=self.schemas.get(day),
+                                     preserve_index=False)
+        if day_file is None:
+            if self.output_format == "parquet":
+                day_file = pa.parquet.ParquetWriter(self.day_file_path(day), table.schema)
+            else:
+                day_file = pa.ipc.new_file(self.day_file_path(day), table.schema)
+            self.files[day] = day_file
+            self.schemas[day] = table.schema
+        day_file.write_table(table)
+
+    def close(self):
+        for day in sorted(self.files):
+            self.files[day].close()
+            print(f"Day {day} file saved: {self.day_file_path(day)}")
+        self.files = {}
+
+
+def parse_size(value):
+    """
+    Parse a size such as 512M, 2G or 1048576 (bytes) into a number of bytes.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", value, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid size '{value}', expected e.g. 512M or 2G.")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def record_sizes(input_file):
+    """
+    Estimated (in-memory, on-disk) bytes of one record of input_file, from its first SIZING_ROWS records.
+    """
+    sample = pd.read_csv(input_file, dtype={"PatientId": str}, nrows=SIZING_ROWS)
+    with open(input_file, "rb") as source:
+        lines = list(itertools.islice(source, len(sample) + 1))
+    rows = max(len(sample), 1)
+    return sample.memory_usage(index=False, deep=True).sum() / rows, sum(len(line) for line in lines[1:]) / rows
+
+
+def common_dtype(dtypes):
+    """
+    dtype pandas infers for a column read whole, from the dtypes it inferred for the column chunk by chunk.
+    """
+    dtypes = set(dtypes)
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    if dtypes <= {np.dtype("int64"), np.dtype("float64")}:
+        return np.dtype("float64")  # Integers with missing values somewhere
+    return str  # Mixed content is left as read
+
+
+def scan_source(input_file, chunk_rows):
+    """
+    First pass of the out-of-core mode. Returns the dtypes the whole file would be read with, its record
+    count, the in-memory bytes of a record and a sorted, evenly spaced sample of its PatientIds.
+    """
+    chunk_dtypes = {}
+    rows = 0
+    frame_bytes = 0
+    sample = []
+    step = 1
+    for chunk in pd.read_csv(input_file, dtype={"PatientId": str}, chunksize=chunk_rows):
+        for column, dtype in chunk.dtypes.items():
+            chunk_dtypes.setdefault(column, []).append(dtype)
+        chunk = chunk[chunk["PatientId"].notna()]
+        frame_bytes += chunk.memory_usage(index=False, deep=True).sum()
+
+        # Every step-th PatientId; the step doubles whenever the sample outgrows BOUNDARY_SAMPLE_ROWS
+        sample.extend(chunk["PatientId"].iloc[(-rows) % step::step])
+        rows += len(chunk)
+        while len(sample) > BOUNDARY_SAMPLE_ROWS:
+            sample = sample[::2]
+            step *= 2
+
+    dtypes = {column: common_dtype(column_dtypes) for column, column_dtypes in chunk_dtypes.items()}
+    return dtypes, rows, frame_bytes / max(rows, 1), sorted(sample)
+
+
+def partition_bounds(sample, partitions):
+    """
+    Bounds splitting the sorted PatientId sample into ranges of about as many records each (at most
+    partitions of them): range i holds the PatientIds p with bounds[i - 1] <= p < bounds[i].
+    """
+    bounds = [sample[len(sample) * i // partitions] for i in range(1, partitions)]
+    return np.array(sorted(set(bounds)), dtype=object)
+
+
+class SpillFiles:
+    """
+    Spill files of the out-of-core mode, appended a frame at a time. At most max_open stay open: the
+    least recently written one is closed to make room, and reopened for appending when it is needed again.
+    """
+
+    def __init__(self, paths, max_open=SPILL_OPEN_FILES):
+        self.paths = paths
+        self.max_open = max(max_open, 1)
+        self.files = OrderedDict()
+
+    def write(self, index, df):
+        spill_file = self.files.get(index)
+        if spill_file is None:
+            if len(self.files) >= self.max_open:
+                self.files.popitem(last=False)[1].close()
+            spill_file = self.files[index] = open(self.paths[index], "ab")
+        else:
+            self.files.move_to_end(index)
+        pickle.dump(df, spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        for spill_file in self.files.values():
+            spill_file.close()
+        self.files = OrderedDict()
+
+
+def spill_partitions(input_file, dtypes, chunk_rows, bounds, spill_dir):
+    """
+    Second pass of the out-of-core mode: read input_file in chunks with dtypes and append every record
+    to the spill file of its PatientId range. Returns the spill file paths in PatientId order.
+    """
+    paths = [os.path.join(spill_dir, f"partition_{index}.pkl") for index in range(len(bounds) + 1)]
+    spill_files = SpillFiles(paths)
+    try:
+        for chunk in pd.read_csv(input_file, dtype=dtypes, chunksize=chunk_rows):
+            chunk = chunk[chunk["PatientId"].notna()]
+            ids = chunk["PatientId"].to_numpy(dtype=object)
+            for index, partition_df in split_by(chunk, np.searchsorted(bounds, ids, side="right")):
+                spill_files.write(index, partition_df)
+    finally:
+        spill_files.close()
+    return paths
+
+
+def read_spill(path):
+    """
+    Records of one spill file, in the order they were read from the source; None when no record went
+    to its partition (its file was never created).
+    """
+    if not os.path.exists(path):
+        return None
+    frames = []
+    with open(path, "rb") as spill_file:
+        while True:
+            try:
+                frames.append(pickle.load(spill_file))
+            except EOFError:
+                break
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def segregate_out_of_core(input_file, output_dir, memory_limit, temp_dir=None, output_format=OUTPUT_FORMAT):
+    """
+    Segregate input_file into Day files using about memory_limit bytes, whatever its size.
+
+    The file is read twice in chunks: once to find the dtypes pandas would give each column reading it
+    whole and to sample PatientIds, then to spill every record to one of several PatientId ranges in
+    temp_dir, each small enough to sort in memory. The merge pass sorts the ranges in PatientId order
+    and appends each range's Day slices to the Day files, which come out identical to those of the
+    in-memory mode.
     """
-    # Create the output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
+    record_bytes, _ = record_sizes(input_file)
+    chunk_rows = max(int(memory_limit // (MEMORY_OVERHEAD * record_bytes)), 1)
+    dtypes, rows, record_bytes, sample = scan_source(input_file, chunk_rows)
+    partitions = max(math.ceil(rows * record_bytes * MEMORY_OVERHEAD / memory_limit), 1)
+    bounds = partition_bounds(sample, partitions)
+    print(f"Segregating {rows} records out of core: {len(bounds) + 1} partitions of chunks of {chunk_rows} rows.")
+
+    with tempfile.TemporaryDirectory(prefix="segregate_", dir=temp_dir) as spill_dir:
+        paths = spill_partitions(input_file, dtypes, chunk_rows, bounds, spill_dir)
+        writers = DayWriters(output_dir, output_format)
+        try:
+            for path in paths:
+                df = read_spill(path)
+                if df is None:
+                    continue
+                os.remove(path)
+                df = df.sort_values(by=["PatientId", "AppointmentID"]).reset_index(drop=True)
+                for day, day_df in day_frames(df):
+                    writers.write(day, day_df)
+                del df
+        finally:
+            writers.close()
 
+
+def read_sorted_source(input_file):
+    """
+    Load the source CSV file into a DataFrame sorted by PatientId and AppointmentID.
+    """
     # Load the source CSV file into a DataFrame, treating PatientId as a string
     df = pd.read_csv(input_file, dtype={"PatientId": str})
 
+    # Records without a PatientId belong to no patient, and so to no Day file
+    df = df[df["PatientId"].notna()]
+
     # Sort the data by PatientId and AppointmentID
-    df = df.sort_values(by=["PatientId", "AppointmentID"]).reset_index(drop=True)
+    return df.sort_values(by=["PatientId", "AppointmentID"]).reset_index(drop=True)
+
+
+def iter_day_frames(input_file):
+    """
+    Yield (day, DataFrame) for every Day of input_file without writing Day files, for loaders running
+    in the same process (see csv_to_postgreSQL.py --from-source). The file is segregated in memory.
+    """
+    yield from day_frames(read_sorted_source(input_file))
+
+
+def segregate_by_days(input_file, output_dir, memory_limit=MEMORY_LIMIT, temp_dir=None, output_format=OUTPUT_FORMAT):
+    """
+    Segregate patient records into Day 1, Day 2, etc., files based on PatientID and AppointmentID:
+    the n-th appointment of a patient goes to Day_n. With a memory_limit (bytes), a file too large
+    to sort within it is segregated out of core, spilling to temp_dir. Day files are written in
+    output_format (see OUTPUT_FORMATS).
+    """
+    # Create the output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
 
-    # Group data by PatientId
-    grouped = df.groupby("PatientId")
+    if memory_limit is not None:
+        record_bytes, disk_bytes = record_sizes(input_file)
+        frame_bytes = os.path.getsize(input_file) / max(disk_bytes, 1) * record_bytes
+        if frame_bytes * MEMORY_OVERHEAD > memory_limit:
+            segregate_out_of_core(input_file, output_dir, memory_limit, temp_dir, output_format)
+            return
 
-    # Create a DataFrame for each "Day N" file
-    day_files = {}
+    write_day_files(read_sorted_source(input_file), output_dir, output_format)
 
-    # Iterate over each patient group
-    for patient_id, patient_data in grouped:
-        # Enumerate records for the patient to segregate by "Day"
-        for day, record in enumerate(patient_data.itertuples(index=False), start=1):
-            if day not in day_files:
-                day_files[day] = []  # Initialize a list for each day
-            
-            # Append the record to the corresponding Day file
-            day_files[day].append(record._asdict())  # Convert namedtuple to dictionary
 
-    # Save each Day file
-    for day, records in day_files.items():
-        day_df = pd.DataFrame(records)  # Convert to DataFrame
-        day_file_path = os.path.join(output_dir, f"Day_{day}.csv")  # Define file path
-        day_df.to_csv(day_file_path, index=False, header=True)  # Save CSV
-        print(f"Day {day} file saved: {day_file_path}")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Segregate patient records into Day files.")
+    parser.add_argument('--input', default=INPUT_FILE, help="source CSV file (default: %(default)s)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="directory of the Day files (default: %(default)s)")
+    parser.add_argument('--memory-limit', type=parse_size, default=MEMORY_LIMIT,
+                        help="memory to stay within, e.g. 512M or 4G; larger files are segregated out of core")
+    parser.add_argument('--temp-dir', default=None,
+                        help="directory for the out-of-core spill files (default: the system temp directory)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT,
+                        help="format of the Day files; parquet and arrow need pyarrow (default: %(default)s)")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     print("Processing and segregating patient records into Day files...")
-    segregate_by_days(INPUT_FILE, OUTPUT_DIR)
-    print(f"Segregation complete. Files are saved in: {OUTPUT_DIR}")
+    segregate_by_days(args.input, args.output_dir, memory_limit=args.memory_limit, temp_dir=args.temp_dir,
+                      output_format=args.format)
+    print(f"Segregation complete. Files are saved in: {args.output_dir}")
 
 
 if __name__ == "__main__":
@@ -1,46 +1,93 @@
-import psycopg2
-from psycopg2.extras import DictCursor
+import argparse
+import csv
+import io
 import logging
+import os
+import sys
+import time
 from datetime import datetime
+from itertools import chain, groupby
+
+# Make the shared modules in the repository root importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import get_connection
+from log_pipeline import configure_logging
 
 # Generate timestamp for logs
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 log_file_path = f'/home/starlord/ETL_PostgreSQL/Subhasis_Tasks/postGreSQL-DataPipeLine-API/LND_to_CORE/log/lnd_to_core_{timestamp}.log'
 
-# Configure logging
-logging.basicConfig(
-    filename=log_file_path,
-    level=logging.INFO,
-    format='%(asctime)s:%(levelname)s:%(message)s'
-)
-
-# Database A (Source) connection details
-DB_A_CONFIG = {
-    'host': 'localhost',
-    'port': '5432',
-    'dbname': 'hospital',
-    'user': 'postgres',
-    'password': 'postgres'
-}
-
-# Database B (Target) connection details
-DB_B_CONFIG = {
-    'host': 'localhost',
-    'port': '5432',
-    'dbname': 'core',
-    'user': 'postgres',
-    'password': 'postgres'
-}
+# Configure logging (queued, written by a listener thread)
+configure_logging(log_file_path, '%(asctime)s:%(levelname)s:%(message)s')
+
+# Database A (Source) and Database B (Target); connection details live in database.py
+SOURCE_DB = 'hospital'
+TARGET_DB = 'core'
+
+# Session profile of the pooled connections (see SESSION_SETTINGS in database.py)
+DB_PROFILE = 'lnd_to_core'
 
 TARGET_TABLE = '"FINAL_LAYER".pat_attendance_core'
 
+# Control table holding the progress of this job, used to resume an interrupted run
+CHECKPOINT_TABLE = '"FINAL_LAYER".etl_checkpoint'
+JOB_NAME = 'lnd_to_core'
+
+# Per-table change counter read by the API to invalidate cached results; bumped with every change
+GENERATION_TABLE = '"FINAL_LAYER".load_generation'
+TARGET_GENERATION_KEY = ('FINAL_LAYER', 'pat_attendance_core')
+
+# Materialized summary of the target read by the API's /aggregate, refreshed after each load that changed
+# the target; its load generation is set to the target generation it was built from
+SUMMARY_VIEW = '"FINAL_LAYER".pat_attendance_summary'
+SUMMARY_GENERATION_KEY = ('FINAL_LAYER', 'pat_attendance_summary')
+
+# Patients merged and committed per transaction; 0 runs the whole landing table in one transaction
+COMMIT_PATIENTS = 10000
+
+# Rows fetched per round trip from the server-side cursor over the landing table
+FETCH_BATCH_SIZE = 10000
+
+# Attributes compared to detect a change (everything except PatientId and AppointmentID)
+TRACKED_COLUMNS = [
+    'Gender', 'ScheduledDay', 'AppointmentDay', 'Age', 'Neighbourhood', 'ScholarshipStatus',
+    'HipertensionStatus', 'DiabetesStatus', 'AlcoholismStatus', 'HandcapStatus', 'SMSReceivedStatus', 'NoShow'
+]
+TARGET_COLUMNS = ['PatientId', 'AppointmentID'] + TRACKED_COLUMNS
+
+# Session-local table each batch is bulk-loaded into before the set-based merge
+STAGE_TABLE = 'scd2_stage'
+
+# History rows hashed per transaction by backfill_row_hashes
+BACKFILL_BATCH_SIZE = 50000
 
-def fetch_source_data():
-    """Fetch data from Database A (Source)."""
+
+def row_hash_sql(alias):
+    """
+    SQL expression for the RowHash of a row: the MD5 of the tracked attributes, '|'-separated.
+    Timestamps are formatted explicitly so the hash does not depend on the session DateStyle.
+    The same expression hashes staged rows and backfills history rows, so the two always agree.
+    """
+    values = []
+    for column in TRACKED_COLUMNS:
+        if column in ('ScheduledDay', 'AppointmentDay'):
+            values.append(f"to_char({alias}.{column}, 'YYYY-MM-DD HH24:MI:SS.US')")
+        else:
+            values.append(f'{alias}.{column}')
+    return f"md5(concat_ws('|', {', '.join(values)}))"
+
+
+def fetch_source_data(batch_size=FETCH_BATCH_SIZE, after_patient_id=None):
+    """
+    Stream data from Database A (Source) through a server-side (named) cursor, ordered by PatientId
+    and AppointmentID, starting after after_patient_id when given (resume of an interrupted run).
+    Yields lists of up to batch_size plain tuples, so memory stays flat however large the landing table is.
+    """
     logging.info("Fetching data from Database A (Source).")
-    try:
-        conn = psycopg2.connect(**DB_A_CONFIG)
-        cursor = conn.cursor(cursor_factory=DictCursor)  # Fetch data as dictionaries
+    with get_connection(SOURCE_DB, DB_PROFILE) as conn:
+        # A named cursor keeps the result set on the server; rows come over batch_size at a time
+        cursor = conn.cursor(name='lnd_to_core_source')
+        cursor.itersize = batch_size
         logging.info("Source Connection established.")
         query = """
             SELECT 
@@ -58,124 +105,423 @@ def fetch_source_data():
                 Handcap, 
                 SMS_received, 
                 No_show
-            FROM "LANDING_LAYER".appointments;
+            FROM "LANDING_LAYER".appointments
+            WHERE %s IS NULL OR PatientId > %s
+            ORDER BY PatientId, AppointmentID;
         """
-        cursor.execute(query)
-        records = cursor.fetchall()
+        cursor.execute(query, (after_patient_id, after_patient_id))
+        rows_fetched = 0
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            rows_fetched += len(batch)
+            yield batch
         cursor.close()
-        conn.close()
-        return records  # Return fetched rows as dictionaries
-    except Exception as e:
-        logging.error(f"Error fetching source data: {e}")
-        return []
+        logging.info(f"Fetched {rows_fetched} rows from the Landing layer.")
 
 
-def upsert_scd2(records):
-    """Insert or update data in Database B (Target) with SCD Type 2 logic."""
-    try:
-        conn = psycopg2.connect(**DB_B_CONFIG)
+def to_target_row(record):
+    """
+    Convert a landing tuple into the target column order (TARGET_COLUMNS), with the flags as booleans.
+    """
+    (patient_id, appointment_id, gender, scheduled_day, appointment_day, age, neighbourhood,
+     scholarship, hipertension, diabetes, alcoholism, handcap, sms_received, no_show) = record
+    return (
+        patient_id, appointment_id, gender, scheduled_day, appointment_day, age, neighbourhood,
+        bool(scholarship), bool(hipertension), bool(diabetes), bool(alcoholism), bool(handcap),
+        bool(sms_received), no_show
+    )
+
+
+def create_stage_table(cursor):
+    """Create (once per session) the temporary table batches are staged in."""
+    cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} (
+            Seq BIGINT PRIMARY KEY, -- Source order, the order the changes are applied in
+            PatientId NUMERIC NOT NULL,
+            AppointmentID BIGINT NOT NULL,
+            Gender CHAR(1),
+            ScheduledDay TIMESTAMP,
+            AppointmentDay TIMESTAMP,
+            Age INTEGER,
+            Neighbourhood VARCHAR(255),
+            ScholarshipStatus BOOLEAN,
+            HipertensionStatus BOOLEAN,
+            DiabetesStatus BOOLEAN,
+            AlcoholismStatus BOOLEAN,
+            HandcapStatus BOOLEAN,
+            SMSReceivedStatus BOOLEAN,
+            NoShow BOOLEAN,
+            RowHash CHAR(32),
+            IsChanged BOOLEAN NOT NULL DEFAULT FALSE
+        );
+    """)
+
+
+def merge_scd2_batch(cursor, batch, first_seq=0):
+    """
+    Merge one batch of landing tuples into the target with a few set-based statements.
+
+    Every row is compared by RowHash with the previous row of the same patient in the batch, or for the
+    patient's first row with the active target row. This yields the same history as applying the rows one by one:
+    changed patients have their active row closed out, every changed row is inserted, and all but the
+    last inserted row per patient are inserted already closed out.
+    Returns the number of rows staged, inserted, expired and unchanged.
+    """
+    columns = ', '.join(TARGET_COLUMNS)
+
+    # Bulk-load the batch into the stage table
+    cursor.execute(f"TRUNCATE {STAGE_TABLE};")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows((seq, *to_target_row(record)) for seq, record in enumerate(batch, start=first_seq))
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {STAGE_TABLE} (Seq, {columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    cursor.execute(f"UPDATE {STAGE_TABLE} s SET RowHash = {row_hash_sql('s')};")
+
+    # Flag the rows that differ from the version they would replace. Active history rows written
+    # before RowHash existed (not backfilled yet) are hashed on the fly.
+    cursor.execute(f"""
+        UPDATE {STAGE_TABLE} s
+        SET IsChanged = TRUE
+        FROM (
+            SELECT st.Seq, st.PatientId, st.RowHash,
+                   LAG(st.RowHash) OVER (PARTITION BY st.PatientId ORDER BY st.Seq) AS PrevRowHash,
+                   LAG(st.Seq) OVER (PARTITION BY st.PatientId ORDER BY st.Seq) AS PrevSeq
+            FROM {STAGE_TABLE} st
+        ) o
+        WHERE s.Seq = o.Seq
+          AND CASE
+              WHEN o.PrevSeq IS NOT NULL THEN o.RowHash <> o.PrevRowHash
+              ELSE NOT EXISTS (
+                  SELECT 1
+                  FROM {TARGET_TABLE} t
+                  WHERE t.IsActive = TRUE
+                    AND t.PatientId = o.PatientId
+                    AND (t.RowHash = o.RowHash OR (t.RowHash IS NULL AND {row_hash_sql('t')} = o.RowHash))
+              )
+          END;
+    """)
+
+    # Close out the active rows of every patient with a change
+    cursor.execute(f"""
+        UPDATE {TARGET_TABLE}
+        SET IsActive = FALSE, RecordEndDate = NOW(), UPDT_DB_TS = NOW()
+        WHERE IsActive = TRUE
+          AND PatientId IN (SELECT PatientId FROM {STAGE_TABLE} WHERE IsChanged);
+    """)
+    expired = cursor.rowcount
+
+    # Insert the new versions; only the last one per patient stays active
+    cursor.execute(f"""
+        INSERT INTO {TARGET_TABLE} (
+            {columns},
+            RecordStartDate, RecordEndDate, IsActive, CR_DB_TS, UPDT_DB_TS, RowHash
+        )
+        SELECT {columns},
+               NOW(), CASE WHEN IsLatest THEN NULL ELSE NOW() END, IsLatest, NOW(), NOW(), RowHash
+        FROM (
+            SELECT s.*, s.Seq = MAX(s.Seq) OVER (PARTITION BY s.PatientId) AS IsLatest
+            FROM {STAGE_TABLE} s
+            WHERE s.IsChanged
+        ) c;
+    """)
+    inserted = cursor.rowcount
+    if inserted or expired:
+        bump_generation(cursor)
+
+    # Versions superseded within the batch were inserted already closed out
+    cursor.execute(f"SELECT COUNT(DISTINCT PatientId) FROM {STAGE_TABLE} WHERE IsChanged;")
+    superseded = inserted - cursor.fetchone()[0]
+
+    return {
+        'staged': len(batch),
+        'inserted': inserted,
+        'expired': expired + superseded,
+        'unchanged': len(batch) - inserted
+    }
+
+
+def bump_generation(cursor):
+    """
+    Advance the load generation of the target table, in the transaction that changes it.
+    """
+    cursor.execute(f"""
+        INSERT INTO {GENERATION_TABLE} AS g (SchemaName, TableName, Generation)
+        VALUES (%s, %s, 1)
+        ON CONFLICT (SchemaName, TableName) DO UPDATE SET
+            Generation = g.Generation + 1,
+            UPDT_DB_TS = NOW();
+    """, TARGET_GENERATION_KEY)
+
+
+def refresh_summary(force=False):
+    """
+    Rebuild the materialized summary when the target changed since it was last built (or when force),
+    and record the target generation it now reflects. Readers are not blocked while it is rebuilt.
+    Returns True when the summary was refreshed.
+    """
+    with get_connection(TARGET_DB, DB_PROFILE) as conn:
         cursor = conn.cursor()
-        logging.info("Target Connection established.")
-
-        for record in records:
-            patient_id = record['patientid']
-            appointment_id = record['appointmentid']  # Included but not part of CDC checks
-            gender = record['gender']
-            scheduled_day = record['scheduledday']
-            appointment_day = record['appointmentday']
-            age = record['age']
-            neighbourhood = record['neighbourhood']
-            scholarship_status = bool(record['scholarship'])
-            hipertension_status = bool(record['hipertension'])
-            diabetes_status = bool(record['diabetes'])
-            alcoholism_status = bool(record['alcoholism'])
-            handcap_status = bool(record['handcap'])
-            sms_received_status = bool(record['sms_received'])
-            no_show = record['no_show']
-
-            # Check if the patient record already exists and is active
-            query_check = f"""
-                SELECT * 
-                FROM {TARGET_TABLE} 
-                WHERE patientid = %s AND IsActive = TRUE;
-            """
-            cursor.execute(query_check, (patient_id,))
-            existing_record = cursor.fetchone()
-
-            if existing_record:
-                # Compare the incoming record with the existing one (excluding AppointmentID)
-                if (
-                    existing_record[2] != gender or
-                    existing_record[3] != scheduled_day or
-                    existing_record[4] != appointment_day or
-                    existing_record[5] != age or
-                    existing_record[6] != neighbourhood or
-                    existing_record[7] != scholarship_status or
-                    existing_record[8] != hipertension_status or
-                    existing_record[9] != diabetes_status or
-                    existing_record[10] != alcoholism_status or
-                    existing_record[11] != handcap_status or
-                    existing_record[12] != sms_received_status or
-                    existing_record[13] != no_show
-                ):
-                    # Mark the current record as inactive
-                    query_update = f"""
-                        UPDATE {TARGET_TABLE}
-                        SET IsActive = FALSE, RecordEndDate = NOW(), UPDT_DB_TS = NOW()
-                        WHERE PatientId = %s AND IsActive = TRUE;
-                    """
-                    cursor.execute(query_update, (patient_id,))
-
-                    # Insert the new version of the record
-                    query_insert = f"""
-                        INSERT INTO {TARGET_TABLE} (
-                            PatientId, AppointmentID, Gender, ScheduledDay, AppointmentDay, Age,
-                            Neighbourhood, ScholarshipStatus, HipertensionStatus, DiabetesStatus,
-                            AlcoholismStatus, HandcapStatus, SMSReceivedStatus, NoShow,
-                            RecordStartDate, IsActive, CR_DB_TS, UPDT_DB_TS
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), TRUE, NOW(), NOW());
-                    """
-                    cursor.execute(query_insert, (
-                        patient_id, appointment_id, gender, scheduled_day, appointment_day, age,
-                        neighbourhood, scholarship_status, hipertension_status, diabetes_status,
-                        alcoholism_status, handcap_status, sms_received_status, no_show
-                    ))
-            else:
-                # Insert a new record as it's not found in the table
-                query_insert = f"""
-                    INSERT INTO {TARGET_TABLE} (
-                        PatientId, AppointmentID, Gender, ScheduledDay, AppointmentDay, Age,
-                        Neighbourhood, ScholarshipStatus, HipertensionStatus, DiabetesStatus,
-                        AlcoholismStatus, HandcapStatus, SMSReceivedStatus, NoShow,
-                        RecordStartDate, IsActive, CR_DB_TS, UPDT_DB_TS
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), TRUE, NOW(), NOW());
-                """
-                cursor.execute(query_insert, (
-                    patient_id, appointment_id, gender, scheduled_day, appointment_day, age,
-                    neighbourhood, scholarship_status, hipertension_status, diabetes_status,
-                    alcoholism_status, handcap_status, sms_received_status, no_show
-                ))
-
-        # Commit the transaction
+        cursor.execute(f"SELECT SchemaName, TableName, Generation FROM {GENERATION_TABLE};")
+        generations = {(schema, table): generation for schema, table, generation in cursor.fetchall()}
+        target_generation = generations.get(TARGET_GENERATION_KEY, 0)
+        if not force and generations.get(SUMMARY_GENERATION_KEY, -1) >= target_generation:
+            logging.info(f"Summary {SUMMARY_VIEW} is current (generation {target_generation}).")
+            cursor.close()
+            return False
+
+        start_time = time.perf_counter()
+        cursor.execute("SELECT ispopulated FROM pg_matviews WHERE schemaname = %s AND matviewname = %s;",
+                       SUMMARY_GENERATION_KEY)
+        row = cursor.fetchone()
+        if row is None:
+            logging.warning(f"Summary {SUMMARY_VIEW} does not exist (see Database_setup.sql), not refreshed.")
+            cursor.close()
+            return False
+        # CONCURRENTLY needs a view that was populated before
+        concurrently = 'CONCURRENTLY ' if row[0] else ''
+        cursor.execute(f"REFRESH MATERIALIZED VIEW {concurrently}{SUMMARY_VIEW};")
+        cursor.execute(f"""
+            INSERT INTO {GENERATION_TABLE} AS g (SchemaName, TableName, Generation)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (SchemaName, TableName) DO UPDATE SET
+                Generation = EXCLUDED.Generation,
+                UPDT_DB_TS = NOW();
+        """, (*SUMMARY_GENERATION_KEY, target_generation))
         conn.commit()
-        logging.info("ETL process completed successfully.")
+        cursor.close()
+    logging.info(f"Summary {SUMMARY_VIEW} refreshed in {time.perf_counter() - start_time:.2f}s "
+                 f"(generation {target_generation}).")
+    return True
+
+
+def landing_load():
+    """
+    Identify the rows currently in the landing table: their count and latest CR_DB_TS, which change
+    with every truncate and reload or append. Stored with the checkpoint so a run only resumes over the
+    landing load it started on.
+    """
+    with get_connection(SOURCE_DB, DB_PROFILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), MAX(CR_DB_TS) FROM "LANDING_LAYER".appointments;')
+        rows, loaded_at = cursor.fetchone()
+        cursor.close()
+    return f"{rows} rows, latest {loaded_at.isoformat() if loaded_at else None}"
+
+
+def load_checkpoint():
+    """
+    Return the checkpoint row of this job as a dict, or None when the job never ran.
+    """
+    with get_connection(TARGET_DB, DB_PROFILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT LastPatientId, LastAppointmentID, PatientsProcessed, RowsProcessed, Status, LandingLoad
+            FROM {CHECKPOINT_TABLE}
+            WHERE JobName = %s;
+        """, (JOB_NAME,))
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        return None
+    return dict(zip(['last_patient_id', 'last_appointment_id', 'patients', 'rows', 'status', 'landing_load'], row))
+
+
+def save_checkpoint(cursor, checkpoint):
+    """
+    Write the checkpoint of this job; the caller commits it together with the rows it covers.
+    """
+    cursor.execute(f"""
+        INSERT INTO {CHECKPOINT_TABLE} (
+            JobName, LastPatientId, LastAppointmentID, PatientsProcessed, RowsProcessed, Status, LandingLoad
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (JobName) DO UPDATE SET
+            LastPatientId = EXCLUDED.LastPatientId,
+            LastAppointmentID = EXCLUDED.LastAppointmentID,
+            PatientsProcessed = EXCLUDED.PatientsProcessed,
+            RowsProcessed = EXCLUDED.RowsProcessed,
+            Status = EXCLUDED.Status,
+            LandingLoad = EXCLUDED.LandingLoad,
+            StartedAt = CASE WHEN {CHECKPOINT_TABLE}.Status = 'RUNNING' AND EXCLUDED.Status = 'RUNNING'
+                             THEN {CHECKPOINT_TABLE}.StartedAt ELSE NOW() END,
+            UPDT_DB_TS = NOW();
+    """, (JOB_NAME, checkpoint['last_patient_id'], checkpoint['last_appointment_id'],
+          checkpoint['patients'], checkpoint['rows'], checkpoint['status'], checkpoint.get('landing_load')))
+
+
+def patient_batches(records, patients_per_batch):
+    """
+    Regroup a stream of source tuples, ordered by PatientId, into lists of patients_per_batch patients.
+    A patient is never split across two lists.
+    """
+    batch = []
+    patients = 0
+    for _, patient_records in groupby(records, key=lambda record: record[0]):
+        batch.extend(patient_records)
+        patients += 1
+        if patients == patients_per_batch:
+            yield batch
+            batch = []
+            patients = 0
+    if batch:
+        yield batch
+
+
+def upsert_scd2(record_batches, commit_patients=COMMIT_PATIENTS, checkpoint=None, landing=None):
+    """
+    Insert or update data in Database B (Target) with SCD Type 2 logic.
+    record_batches is any iterable of lists of source tuples ordered by PatientId; each batch is merged
+    with set-based statements as soon as it arrives. Every commit_patients patients the work is committed
+    together with the checkpoint, so an interrupted run resumes after the last committed patient
+    (commit_patients=0 commits once, at the end). checkpoint carries the counters of the run being resumed;
+    landing identifies the landing load being read (see landing_load) and is kept with the checkpoint.
+    Returns the number of rows staged, inserted, expired and unchanged by this run.
+    """
+    totals = {'staged': 0, 'inserted': 0, 'expired': 0, 'unchanged': 0}
+    checkpoint = dict(checkpoint or {'last_patient_id': None, 'last_appointment_id': None, 'patients': 0, 'rows': 0})
+    checkpoint['status'] = 'RUNNING'
+    checkpoint['landing_load'] = landing
+    try:
+        with get_connection(TARGET_DB, DB_PROFILE) as conn:
+            cursor = conn.cursor()
+            logging.info("Target Connection established.")
+            create_stage_table(cursor)
+            save_checkpoint(cursor, checkpoint)
+            conn.commit()
+
+            if commit_patients:
+                record_batches = patient_batches(chain.from_iterable(record_batches), commit_patients)
+
+            start_time = time.perf_counter()
+            for batch in record_batches:
+                counts = merge_scd2_batch(cursor, batch, totals['staged'])
+                for key in totals:
+                    totals[key] += counts[key]
+                logging.info(f"Merged batch of {counts['staged']} rows: {counts['inserted']} inserted, "
+                             f"{counts['expired']} expired, {counts['unchanged']} unchanged.")
+
+                # Fetch batches (commit_patients=0) can split a patient: one continued from the previous
+                # batch was counted there already
+                patients = {record[0] for record in batch}
+                patients.discard(checkpoint['last_patient_id'])
+                checkpoint['patients'] += len(patients)
+                checkpoint['last_patient_id'], checkpoint['last_appointment_id'] = batch[-1][0], batch[-1][1]
+                checkpoint['rows'] += len(batch)
+                if commit_patients:
+                    save_checkpoint(cursor, checkpoint)
+                    conn.commit()
+                    elapsed = time.perf_counter() - start_time
+                    logging.info(f"Committed through PatientId {checkpoint['last_patient_id']} "
+                                 f"(AppointmentID {checkpoint['last_appointment_id']}): "
+                                 f"{checkpoint['patients']} patients, {checkpoint['rows']} rows processed, "
+                                 f"{totals['staged'] / elapsed if elapsed else 0:.0f} rows/s.")
+
+            # Commit the transaction
+            checkpoint['status'] = 'COMPLETE'
+            save_checkpoint(cursor, checkpoint)
+            conn.commit()
+            cursor.close()
+            logging.info(f"ETL process completed successfully in {time.perf_counter() - start_time:.2f}s. "
+                         f"Rows staged: {totals['staged']}, inserted: {totals['inserted']}, "
+                         f"expired: {totals['expired']}, unchanged: {totals['unchanged']}.")
     except Exception as e:
+        # The open transaction is rolled back when the connection goes back to the pool;
+        # everything up to the last checkpoint stays committed
         logging.error(f"Error in ETL process: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    return totals
+
+
+def backfill_row_hashes(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Fill in RowHash for history rows written before the column existed, batch_size rows per transaction.
+    Safe to interrupt and run again. Returns the number of rows updated.
+    """
+    logging.info("Backfilling RowHash in the Core layer.")
+    rows_updated = 0
+    with get_connection(TARGET_DB, DB_PROFILE) as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(f"""
+                UPDATE {TARGET_TABLE} t
+                SET RowHash = {row_hash_sql('t')}
+                WHERE t.ctid IN (
+                    SELECT ctid FROM {TARGET_TABLE} WHERE RowHash IS NULL LIMIT %s
+                );
+            """, (batch_size,))
+            updated = cursor.rowcount
+            if updated:
+                bump_generation(cursor)
+            conn.commit()
+            if updated == 0:
+                break
+            rows_updated += updated
+            logging.info(f"Backfilled RowHash for {rows_updated} rows so far.")
+        cursor.close()
+    logging.info(f"RowHash backfill completed: {rows_updated} rows updated.")
+    return rows_updated
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load the Landing layer into the Core layer with SCD Type 2 history.")
+    parser.add_argument('--backfill-row-hash', action='store_true',
+                        help="fill in RowHash for existing history rows instead of running the ETL")
+    parser.add_argument('--commit-patients', type=int, default=COMMIT_PATIENTS,
+                        help=f"patients per committed batch, 0 for a single transaction (default: {COMMIT_PATIENTS})")
+    parser.add_argument('--fetch-batch-size', type=int, default=FETCH_BATCH_SIZE,
+                        help=f"rows fetched per round trip from the landing table (default: {FETCH_BATCH_SIZE})")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore the checkpoint of an interrupted run and start from the first patient")
+    parser.add_argument('--refresh-summary', action='store_true',
+                        help="rebuild the materialized summary read by the API's /aggregate instead of running the ETL")
+    return parser.parse_args()
 
 
 # Main ETL process
 if __name__ == "__main__":
+    args = parse_args()
+    if args.backfill_row_hash:
+        backfill_row_hashes()
+        sys.exit(0)
+    if args.refresh_summary:
+        refresh_summary(force=True)
+        sys.exit(0)
+
     logging.info("Starting ETL process from Landing to Core.")
-    source_data = fetch_source_data()
-    if source_data:
-        logging.info("Data is available in the Landing layer. Proceeding with upsert.")
-        upsert_scd2(source_data)
+    checkpoint = load_checkpoint()
+    landing = landing_load()
+    if not checkpoint or checkpoint['status'] != 'RUNNING' or args.restart:
+        checkpoint = None
+    elif checkpoint['landing_load'] != landing:
+        # The landing table was reloaded since the interrupted run; the PatientIds after the
+        # checkpoint are not the rows still to process
+        logging.warning(f"Landing table changed since the interrupted run ({checkpoint['landing_load']}, "
+                        f"now {landing}); starting from the first patient.")
+        checkpoint = None
     else:
-        logging.warning("No data fetched from source.")
+        logging.info(f"Resuming the interrupted run after PatientId {checkpoint['last_patient_id']} "
+                     f"({checkpoint['patients']} patients, {checkpoint['rows']} rows already processed).")
+    source_batches = fetch_source_data(args.fetch_batch_size, checkpoint and checkpoint['last_patient_id'])
+    try:
+        first_batch = next(source_batches, None)
+        if first_batch:
+            logging.info("Data is available in the Landing layer. Proceeding with upsert.")
+            upsert_scd2(chain([first_batch], source_batches), args.commit_patients, checkpoint, landing)
+        elif checkpoint:
+            logging.info("No rows left after the checkpoint.")
+            upsert_scd2([], args.commit_patients, checkpoint, landing)
+        else:
+            logging.warning("No data fetched from source.")
+    except Exception as e:
+        logging.error(f"Error fetching source data: {e}")
+    finally:
+        # Releases the source connection even when the upsert stopped before reading every batch
+        source_batches.close()
+
+    # Also catches up after an earlier run that changed the target but stopped before refreshing
+    try:
+        refresh_summary()
+    except Exception as e:
+        logging.error(f"Error refreshing summary {SUMMARY_VIEW}: {e}")
@@ -2,166 +2,718 @@ import pandas as pd
 from psycopg2.extras import execute_values
 import psycopg2
 import logging
+import sys
 from datetime import datetime
 import shutil
 import os
 import glob
+import io
+import time
+import argparse
+import resource
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# Make the shared modules in the repository root importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import DB_CONFIGS, get_connection
+from log_pipeline import RowErrorLog, configure_logging
+import appointments_schema
+from File_segregator.File_segregator import iter_day_frames
 
 # Generate log file name with timestamp
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 log_file_path = f'/home/starlord/ETL_PostgreSQL/Subhasis_Tasks/postGreSQL-DataPipeLine-API/Src_to_LND/logs/csv_to_postgresql_{timestamp}.log'
 
-# Configure logging
-logging.basicConfig(filename=log_file_path, level=logging.INFO, 
-                    format='%(asctime)s:%(levelname)s:%(message)s')
+# Configure logging (queued, written by a listener thread)
+configure_logging(log_file_path, '%(asctime)s:%(levelname)s:%(message)s')
 
 # Paths
 CSV_DIR = r'/home/starlord/ETL_PostgreSQL/Subhasis_Tasks/postGreSQL-DataPipeLine-API/Src_to_LND/Source_Path/'  # Directory containing CSV files
 ARCHIVE_DIR = r'/home/starlord/ETL_PostgreSQL/Subhasis_Tasks/postGreSQL-DataPipeLine-API/Src_to_LND/Archive_Path'  # Directory for processed files
 ERROR_DIR = r'/home/starlord/ETL_PostgreSQL/Subhasis_Tasks/postGreSQL-DataPipeLine-API/Src_to_LND/Bad_Files/'  # Directory for error files
 
+# Source files picked up from CSV_DIR: CSV, and the Parquet and Arrow IPC Day files File_segregator.py
+# writes with --format parquet/arrow, which are read as typed columns without any parsing (needs pyarrow)
+SOURCE_PATTERNS = ["*.csv", "*.parquet", "*.arrow"]
+
 # Table and database configuration
 TABLE_NAME = "appointments"  # Table name without schema
 DB_CONFIG = {
-    'user': 'postgres',
-    'password': 'postgres',
-    'host': 'localhost',
-    'port': '5432',
-    'dbname': 'hospital',
+    **DB_CONFIGS['hospital'],  # Connection details are shared with the other stages (database.py)
     'schema': 'LANDING_LAYER'  # Add schema to the configuration
 }
 
+# Session profile of the pooled landing connections (see SESSION_SETTINGS in database.py)
+DB_PROFILE = 'landing'
+
+# Validation rules, taken from the constraints on "LANDING_LAYER".appointments in Database_setup.sql
+VALID_GENDERS = ['F', 'M']  # Gender CHAR(1)
+NON_NEGATIVE_COLUMNS = ['age', 'handcap']  # CHECK (Age >= 0), CHECK (Handcap >= 0)
+TIMESTAMP_COLUMNS = appointments_schema.TIMESTAMP_COLUMNS  # TIMESTAMP NOT NULL
+
+# Load manifest recording every file loaded into the landing layer (see Database_setup.sql)
+MANIFEST_TABLE = "load_manifest"
+
+# "truncate" empties the landing table and reloads every file; "append" keeps the table, skips files
+# whose content is already in the manifest and inserts only AppointmentIDs not yet loaded
+LOAD_MODE = "truncate"
+
+# Loader used for valid rows: "copy" streams them through COPY ... FROM STDIN,
+# "insert" uses psycopg2.extras.execute_values
+LOAD_METHOD = "copy"
+
+# Rows read, validated and loaded per chunk in streaming mode (None loads the whole file at once)
+CHUNK_ROWS = None
+
+# Parallel mode: worker processes that parse and validate files, and the maximum number of
+# database connections used to load them (WORKERS = 1 keeps the serial loop)
+WORKERS = 1
+DB_CONNECTIONS = 2
+
 def truncate_table(table_name, db_config):
     """
     Truncate the target table before processing CSV files.
     """
     try:
-        conn = psycopg2.connect(
-            dbname=db_config['dbname'],
-            user=db_config['user'],
-            password=db_config['password'],
-            host=db_config['host'],
-            port=db_config['port']
-        )
-        cursor = conn.cursor()
+        with get_connection(db_config['dbname'], DB_PROFILE) as conn:
+            cursor = conn.cursor()
 
-        schema_quoted = f'"{db_config["schema"]}"'
-        table_quoted = f'"{table_name}"'
-        logging.info(f"Truncating table: {schema_quoted}.{table_quoted}")
-        cursor.execute(f"TRUNCATE TABLE {schema_quoted}.{table_quoted} RESTART IDENTITY;")
-        conn.commit()
-        logging.info(f"Table {db_config['schema']}.{table_name} truncated successfully.")
-        cursor.close()
-        conn.close()
+            schema_quoted = f'"{db_config["schema"]}"'
+            table_quoted = f'"{table_name}"'
+            logging.info(f"Truncating table: {schema_quoted}.{table_quoted}")
+            cursor.execute(f"TRUNCATE TABLE {schema_quoted}.{table_quoted} RESTART IDENTITY;")
+            conn.commit()
+            logging.info(f"Table {db_config['schema']}.{table_name} truncated successfully.")
+            cursor.close()
     except Exception as e:
         logging.error(f"Error truncating table {db_config['schema']}.{table_name}: {e}")
         raise
 
-def insert_data_with_psycopg2(df, table_name, db_config):
+def qualified_table_name(table_name, db_config):
+    """
+    Return the schema-qualified name of a table in the configured schema.
+    """
+    schema_quoted = f'"{db_config["schema"]}"'
+    return f"{schema_quoted}.{table_name}"
+
+def insert_rows(cursor, df, target_table):
+    """
+    Insert the DataFrame's rows with execute_values on an open cursor. The caller commits.
+    """
+    # Build the SQL INSERT statement
+    columns = ', '.join(df.columns)
+    insert_query = f"""
+        INSERT INTO {target_table} ({columns})
+        VALUES %s
+    """
+
+    start_time = time.perf_counter()
+
+    # Convert DataFrame to a list of tuples for psycopg2
+    data = df.values.tolist()
+
+    # Use execute_values for bulk insertion
+    execute_values(cursor, insert_query, data)
+    log_load_rate("execute_values", len(df), time.perf_counter() - start_time)
+
+def copy_rows(cursor, df, target_table):
+    """
+    Stream the DataFrame's rows through COPY ... FROM STDIN on an open cursor. The caller commits.
+    """
+    columns = ', '.join(df.columns)
+    copy_query = f"COPY {target_table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+
+    start_time = time.perf_counter()
+
+    # Serialize the rows once into a CSV buffer; NaN/None become empty fields, i.e. NULL
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    cursor.copy_expert(copy_query, buffer)
+    log_load_rate("COPY", len(df), time.perf_counter() - start_time)
+
+def load_rows(cursor, df, table_name, db_config, load_method=LOAD_METHOD, load_mode=LOAD_MODE):
+    """
+    Load the DataFrame's rows on an open cursor and return the number of rows added to the table.
+    In append mode the rows go through a temporary staging table and only new AppointmentIDs are inserted.
+    """
+    target_table = qualified_table_name(table_name, db_config)
+    load_target = target_table
+    if load_mode == "append":
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS landing_stage "
+                       f"(LIKE {target_table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.execute("TRUNCATE landing_stage")
+        load_target = "landing_stage"
+
+    if load_method == "copy":
+        copy_rows(cursor, df, load_target)
+    else:
+        insert_rows(cursor, df, load_target)
+
+    if load_mode != "append":
+        return len(df)
+
+    columns = ', '.join(df.columns)
+    cursor.execute(f"""
+        INSERT INTO {target_table} ({columns})
+        SELECT {columns} FROM landing_stage
+        ON CONFLICT (appointmentid) DO NOTHING
+    """)
+    logging.info(f"Append mode: {cursor.rowcount} new AppointmentIDs inserted, "
+                 f"{len(df) - cursor.rowcount} already present in {target_table}.")
+    return cursor.rowcount
+
+def record_manifest(cursor, db_config, manifest_entry, status):
+    """
+    Insert or update the manifest row of a file on an open cursor. The caller commits, so a LOADED entry
+    is committed in the same transaction as the rows it describes.
+    """
+    cursor.execute(f"""
+        INSERT INTO {qualified_table_name(MANIFEST_TABLE, db_config)} (
+            FileHash, FileName, RowsLoaded, RowsRejected, LoadMode, Status, LoadedAt
+        ) VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (FileHash) DO UPDATE SET
+            FileName = EXCLUDED.FileName,
+            RowsLoaded = EXCLUDED.RowsLoaded,
+            RowsRejected = EXCLUDED.RowsRejected,
+            LoadMode = EXCLUDED.LoadMode,
+            Status = EXCLUDED.Status,
+            LoadedAt = EXCLUDED.LoadedAt;
+    """, (
+        manifest_entry['file_hash'], manifest_entry['file_name'], manifest_entry.get('rows_loaded', 0),
+        manifest_entry.get('rows_rejected', 0), manifest_entry['load_mode'], status
+    ))
+
+def save_manifest_entry(db_config, manifest_entry, status):
+    """
+    Record a manifest entry in its own transaction (failed loads and files without valid rows).
+    """
+    try:
+        with get_connection(db_config['dbname'], DB_PROFILE) as conn:
+            cursor = conn.cursor()
+            record_manifest(cursor, db_config, manifest_entry, status)
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        logging.error(f"Error recording manifest entry for {manifest_entry['file_name']}: {e}")
+
+def fetch_loaded_hashes(db_config):
+    """
+    Return the content hashes of all files the manifest records as loaded.
+    """
+    with get_connection(db_config['dbname'], DB_PROFILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT FileHash FROM {qualified_table_name(MANIFEST_TABLE, db_config)} WHERE Status = 'LOADED';")
+        loaded_hashes = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return loaded_hashes
+
+def compute_file_hash(file_path, block_size=1024 * 1024):
+    """
+    Return the SHA-256 hex digest of a file's content, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def insert_data_with_psycopg2(df, table_name, db_config, load_mode=LOAD_MODE, manifest_entry=None):
     """
     Insert data into PostgreSQL using psycopg2.extras.execute_values for bulk insertion.
     """
     try:
-        conn = psycopg2.connect(
-            dbname=db_config['dbname'],
-            user=db_config['user'],
-            password=db_config['password'],
-            host=db_config['host'],
-            port=db_config['port']
-        )
+        with get_connection(db_config['dbname'], DB_PROFILE) as conn:
+            cursor = conn.cursor()
+            rows_loaded = load_rows(cursor, df, table_name, db_config, "insert", load_mode)
+            if manifest_entry:
+                manifest_entry['rows_loaded'] = rows_loaded
+                record_manifest(cursor, db_config, manifest_entry, 'LOADED')
+            conn.commit()
+
+            logging.info(f"Data successfully inserted into {db_config['schema']}.{table_name}.")
+            cursor.close()
+            return rows_loaded
+    except Exception as e:
+        logging.error(f"Error inserting data: {e}")
+        raise
+
+def copy_data_with_psycopg2(df, table_name, db_config, load_mode=LOAD_MODE, manifest_entry=None):
+    """
+    Load data into PostgreSQL with COPY ... FROM STDIN, streaming the rows from an in-memory CSV buffer.
+    Falls back to insert_data_with_psycopg2 only when the server does not support COPY.
+    """
+    try:
+        with get_connection(db_config['dbname'], DB_PROFILE) as conn:
+            cursor = conn.cursor()
+            rows_loaded = load_rows(cursor, df, table_name, db_config, "copy", load_mode)
+            if manifest_entry:
+                manifest_entry['rows_loaded'] = rows_loaded
+                record_manifest(cursor, db_config, manifest_entry, 'LOADED')
+            conn.commit()
+
+            logging.info(f"Data successfully copied into {db_config['schema']}.{table_name}.")
+            cursor.close()
+            return rows_loaded
+    except psycopg2.NotSupportedError as e:
+        # The failed transaction was rolled back when the connection went back to the pool
+        logging.warning(f"COPY is not available ({e}). Falling back to execute_values.")
+        return insert_data_with_psycopg2(df, table_name, db_config, load_mode, manifest_entry)
+    except Exception as e:
+        logging.error(f"Error copying data: {e}")
+        raise
+
+def log_load_rate(method, row_count, elapsed):
+    """
+    Log the number of rows loaded and the load throughput in rows/second.
+    """
+    rows_per_second = row_count / elapsed if elapsed > 0 else float('inf')
+    logging.info(f"{method} loaded {row_count} rows in {elapsed:.3f}s ({rows_per_second:,.0f} rows/s).")
+
+def validate_dataframe(df, row_errors=None):
+    """
+    Validate all rows at once using whole-column boolean masks, one per rule.
+    Returns the valid rows, the invalid rows and the number of rows rejected by each rule.
+    Rejected rows are logged through row_errors (a RowErrorLog shared by the chunks of a file),
+    or through one of their own, summarized here, when it is not given.
+    """
+    rule_masks = {'null_values': df.isnull().any(axis=1)}
+    parsed_columns = {}
+
+    for column, dtype in appointments_schema.INTEGER_COLUMNS.items():
+        if column in df.columns:
+            parsed = appointments_schema.parse_integers(df[column], dtype)
+            # Non-numeric, fractional and out-of-range values parse to <NA> and are rejected, as are
+            # negative ones where the column must not be negative
+            invalid = parsed.isna() & df[column].notna()
+            if column in NON_NEGATIVE_COLUMNS:
+                invalid |= parsed < 0
+            rule_masks[f'invalid_{column}'] = invalid
+            parsed_columns[column] = parsed
+
+    if 'gender' in df.columns:
+        rule_masks['invalid_gender'] = df['gender'].notna() & ~df['gender'].isin(VALID_GENDERS)
+
+    for column in TIMESTAMP_COLUMNS:
+        if column in df.columns:
+            parsed = appointments_schema.parse_timestamps(df[column])
+            rule_masks[f'invalid_{column}'] = parsed.isna() & df[column].notna()
+            parsed_columns[column] = parsed
+
+    # Comparisons on nullable integer columns (e.g. from Parquet files) are <NA> for missing values,
+    # which the null rule already covers
+    rule_masks = {rule: mask.fillna(False).astype(bool) for rule, mask in rule_masks.items()}
+
+    invalid_mask = pd.Series(False, index=df.index)
+    for mask in rule_masks.values():
+        invalid_mask |= mask
+
+    rejection_counts = {rule: int(mask.sum()) for rule, mask in rule_masks.items()}
+    invalid_df = df[invalid_mask]
+
+    # Rejected rows are all written to the error file; the log only gets a rate-limited sample of them
+    if not invalid_df.empty:
+        summarize = row_errors is None
+        if summarize:
+            row_errors = RowErrorLog("Invalid rows")
+        reasons = None
+        for position, index in enumerate(invalid_df.index):
+            if not row_errors.allow():
+                continue
+            if reasons is None:
+                reasons = pd.Series('', index=invalid_df.index)
+                for rule, mask in rule_masks.items():
+                    reasons[mask[invalid_mask]] += rule + ' '
+            row = invalid_df.iloc[position].to_dict()
+            logging.error(f"Invalid row at index {index}: {row}, Failed rules: {reasons[index].strip()}")
+        if summarize:
+            row_errors.summary()
+
+    # Valid rows carry the parsed integers and timestamps; invalid ones keep the values as read for the error file
+    valid_df = df[~invalid_mask].assign(**{column: parsed[~invalid_mask] for column, parsed in parsed_columns.items()})
+    # No integer is missing in the valid rows, so they go back to plain integer dtypes
+    valid_df = valid_df.astype({column: dtype for column, dtype in appointments_schema.INTEGER_COLUMNS.items()
+                                if column in valid_df.columns})
+    return valid_df, invalid_df, rejection_counts
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of this process in MB.
+    """
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def error_file_for(csv_file_path, error_dir):
+    """
+    Return the path of the error file collecting the invalid rows of a source file.
+    """
+    source_name = os.path.splitext(os.path.basename(csv_file_path))[0]
+    return os.path.join(error_dir, f'invalid_records_{timestamp}_{source_name}.csv')
+
+def write_invalid_rows(invalid_df, error_file_path):
+    """
+    Append invalid rows to the error file, writing the header only when the file is created.
+    """
+    write_header = not os.path.exists(error_file_path)
+    invalid_df.to_csv(error_file_path, mode='a', header=write_header, index=False)
+
+def read_source_file(file_path):
+    """
+    Read a whole source file (CSV, Parquet or Arrow IPC) into a DataFrame with the landing columns.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.parquet':
+        return appointments_schema.conform(pd.read_parquet(file_path))
+    if extension == '.arrow':
+        return appointments_schema.conform(pd.read_feather(file_path))
+    return appointments_schema.read_csv(file_path)
+
+def iter_source_chunks(file_path, chunk_rows):
+    """
+    Yield a source file (CSV, Parquet or Arrow IPC) as DataFrames of at most chunk_rows rows, with the landing columns.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.parquet':
+        import pyarrow.parquet  # Only needed for Parquet and Arrow sources
+        for batch in pyarrow.parquet.ParquetFile(file_path).iter_batches(batch_size=chunk_rows):
+            yield appointments_schema.conform(batch.to_pandas())
+    elif extension == '.arrow':
+        import pyarrow
+        import pyarrow.ipc
+        # The file is memory-mapped, so only the batch being converted is read into memory
+        with pyarrow.memory_map(file_path) as source:
+            for batch in pyarrow.ipc.open_file(source).read_all().to_batches(max_chunksize=chunk_rows):
+                yield appointments_schema.conform(batch.to_pandas())
+    else:
+        yield from appointments_schema.iter_csv(file_path, chunk_rows)
+
+def stream_csv_to_postgres(csv_file_path, table_name, db_config, error_file_path, chunk_rows,
+                           load_method=LOAD_METHOD, load_mode=LOAD_MODE, manifest_entry=None):
+    """
+    Load a source file chunk by chunk over a single connection so that memory stays bounded by chunk_rows.
+    Each chunk is validated and loaded under its own savepoint, and the transaction is committed after
+    the last chunk together with the file's manifest entry. A chunk the database rejects fails the whole
+    file, as in the non-streaming path: the error propagates and nothing of the file is committed.
+    Returns the number of rows loaded and the number of rows rejected.
+    """
+    # Anything not committed (a failure before the last chunk) is rolled back when the connection is returned
+    with get_connection(db_config['dbname'], DB_PROFILE) as conn:
         cursor = conn.cursor()
+        rows_loaded = 0
+        rows_rejected = 0
+        row_errors = RowErrorLog(f"Invalid rows of {csv_file_path}")
 
-        # Build the SQL INSERT statement
-        columns = ', '.join(df.columns)
-        values_placeholder = ', '.join(['%s'] * len(df.columns))
-        schema_quoted = f'"{db_config["schema"]}"'
-        insert_query = f"""
-            INSERT INTO {schema_quoted}.{table_name} ({columns})
-            VALUES %s
-        """
+        for chunk_number, chunk in enumerate(iter_source_chunks(csv_file_path, chunk_rows), start=1):
+            valid_df, invalid_df, rejection_counts = validate_dataframe(chunk, row_errors)
 
-        # Convert DataFrame to a list of tuples for psycopg2
-        data = df.values.tolist()
+            if not valid_df.empty:
+                cursor.execute("SAVEPOINT landing_chunk")
+                try:
+                    rows_loaded += load_rows(cursor, valid_df, table_name, db_config, load_method, load_mode)
+                    cursor.execute("RELEASE SAVEPOINT landing_chunk")
+                except psycopg2.NotSupportedError as e:
+                    logging.warning(f"COPY is not available ({e}). Falling back to execute_values.")
+                    cursor.execute("ROLLBACK TO SAVEPOINT landing_chunk")
+                    load_method = "insert"
+                    rows_loaded += load_rows(cursor, valid_df, table_name, db_config, load_method, load_mode)
+                    cursor.execute("RELEASE SAVEPOINT landing_chunk")
 
-        # Use execute_values for bulk insertion
-        execute_values(cursor, insert_query, data)
-        conn.commit()
+            if not invalid_df.empty:
+                write_invalid_rows(invalid_df, error_file_path)
+                rows_rejected += len(invalid_df)
+
+            logging.info(f"Chunk {chunk_number} of {csv_file_path}: {len(chunk)} rows read, "
+                         f"{rows_loaded} loaded and {rows_rejected} rejected so far. "
+                         f"Rejections per rule: {rejection_counts}. Peak RSS: {peak_rss_mb():.1f} MB")
 
-        logging.info(f"Data successfully inserted into {db_config['schema']}.{table_name}.")
+        row_errors.summary()
+        if manifest_entry:
+            manifest_entry.update(rows_loaded=rows_loaded, rows_rejected=rows_rejected)
+            record_manifest(cursor, db_config, manifest_entry, 'LOADED')
+        conn.commit()
         cursor.close()
-        conn.close()
+        return rows_loaded, rows_rejected
+
+def validate_source_frame(df, source_name):
+    """
+    Split the rows of a whole source file, with the landing columns, into valid and invalid rows.
+    """
+    # Separate valid and invalid rows
+    start_time = time.perf_counter()
+    valid_df, invalid_df, rejection_counts = validate_dataframe(df)
+    logging.info(f"Validated {len(df)} rows of {source_name} in {(time.perf_counter() - start_time) * 1000:.1f} ms: "
+                 f"{len(valid_df)} valid, {len(invalid_df)} invalid. Rejections per rule: {rejection_counts}")
+    return valid_df, invalid_df
+
+def read_and_validate_csv(csv_file_path):
+    """
+    Read a whole source file into memory and split it into valid and invalid rows.
+    In parallel mode this runs in a worker process.
+    """
+    # Load the file into a Pandas DataFrame
+    df = read_source_file(csv_file_path)
+    logging.info(f"Data loaded from {csv_file_path}.")
+
+    return validate_source_frame(df, csv_file_path)
+
+def load_validated_rows(valid_df, invalid_df, table_name, db_config, error_file_path, load_method=LOAD_METHOD,
+                        load_mode=LOAD_MODE, manifest_entry=None):
+    """
+    Load the valid rows in one transaction, then write the invalid rows to the error file.
+    """
+    if manifest_entry:
+        manifest_entry['rows_rejected'] = len(invalid_df)
+
+    # Insert valid rows into PostgreSQL
+    if not valid_df.empty:
+        if load_method == "copy":
+            copy_data_with_psycopg2(valid_df, table_name, db_config, load_mode, manifest_entry)
+        else:
+            insert_data_with_psycopg2(valid_df, table_name, db_config, load_mode, manifest_entry)
+    elif manifest_entry:
+        save_manifest_entry(db_config, manifest_entry, 'LOADED')
+
+    # Write invalid rows to the error file
+    if not invalid_df.empty:
+        write_invalid_rows(invalid_df, error_file_path)
+        logging.warning(f"Invalid rows written to {error_file_path}.")
+
+def archive_file(csv_file_path, archive_dir):
+    """
+    Move a processed source file to the archive directory.
+    """
+    if not os.path.exists(archive_dir):
+        os.makedirs(archive_dir, exist_ok=True)  # Create archive directory if it doesn't exist
+
+    archive_path = os.path.join(archive_dir, os.path.basename(csv_file_path))
+    shutil.move(csv_file_path, archive_path)
+    logging.info(f"Source file {csv_file_path} moved to archive directory: {archive_path}.")
+
+def new_manifest_entry(csv_file_path, file_hash, load_mode=LOAD_MODE):
+    """
+    Return the manifest entry describing the load of a source file, or None when no hash was computed.
+    """
+    if not file_hash:
+        return None
+    return {'file_hash': file_hash, 'file_name': os.path.basename(csv_file_path), 'load_mode': load_mode}
+
+def load_parsed_file_with_archiving(csv_file_path, valid_df, invalid_df, table_name, db_config, archive_dir,
+                                    error_dir, load_method=LOAD_METHOD, load_mode=LOAD_MODE, file_hash=None):
+    """
+    Load an already validated file and archive it once its load has committed.
+    In parallel mode this runs in one of the DB_CONNECTIONS loader threads.
+    """
+    manifest_entry = new_manifest_entry(csv_file_path, file_hash, load_mode)
+    try:
+        load_validated_rows(valid_df, invalid_df, table_name, db_config, error_file_for(csv_file_path, error_dir),
+                            load_method, load_mode, manifest_entry)
+        archive_file(csv_file_path, archive_dir)
     except Exception as e:
-        logging.error(f"Error inserting data: {e}")
-        raise
+        logging.error(f"Error: {e}")
+        if manifest_entry:
+            save_manifest_entry(db_config, manifest_entry, 'FAILED')
 
-def load_csv_to_postgres_with_archiving(csv_file_path, table_name, db_config, archive_dir, error_dir):
+def load_csv_to_postgres_with_archiving(csv_file_path, table_name, db_config, archive_dir, error_dir,
+                                        load_method=LOAD_METHOD, chunk_rows=CHUNK_ROWS, load_mode=LOAD_MODE,
+                                        file_hash=None):
+    error_file_path = error_file_for(csv_file_path, error_dir)
+    manifest_entry = new_manifest_entry(csv_file_path, file_hash, load_mode)
     try:
-        # Load CSV into Pandas DataFrame
-        df = pd.read_csv(csv_file_path)
-        logging.info(f"Data loaded from {csv_file_path}.")
-        
-        # Convert column names to lowercase
-        df.columns = map(str.lower, df.columns)
-        
-        # Separate valid and invalid rows
-        valid_rows = []
-        invalid_rows = []
-
-        # Validate data row by row
-        for index, row in df.iterrows():
+        if chunk_rows:
+            # Invalid rows are staged next to the error file and only published once the load has committed
+            staged_error_file_path = error_file_path + '.part'
             try:
-                # Example validation: Check for missing or invalid data
-                if row.isnull().any() or (row['age'] < 0):  # Invalid if age is negative or any column is missing
-                    raise ValueError(f"Invalid data: {row.to_dict()}")
-                valid_rows.append(row)
-            except Exception as e:
-                invalid_rows.append(row)
-                logging.error(f"Invalid row at index {index}: {row.to_dict()}, Error: {e}")
-
-        # Convert valid rows back to a DataFrame
-        valid_df = pd.DataFrame(valid_rows)
-        
-        # Insert valid rows into PostgreSQL
-        if not valid_df.empty:
-            insert_data_with_psycopg2(valid_df, table_name, db_config)
-
-        # Write invalid rows to the error file
-        if invalid_rows:
-            invalid_df = pd.DataFrame(invalid_rows)
-            error_file_path = os.path.join(error_dir, f'invalid_records_{timestamp}.csv')
-            invalid_df.to_csv(error_file_path, index=False)
-            logging.warning(f"Invalid rows written to {error_file_path}.")
+                rows_loaded, rows_rejected = stream_csv_to_postgres(
+                    csv_file_path, table_name, db_config, staged_error_file_path, chunk_rows, load_method,
+                    load_mode, manifest_entry
+                )
+            except Exception:
+                if os.path.exists(staged_error_file_path):
+                    os.remove(staged_error_file_path)
+                raise
+            logging.info(f"Streamed {csv_file_path} in chunks of {chunk_rows} rows: {rows_loaded} loaded, "
+                         f"{rows_rejected} rejected. Peak RSS: {peak_rss_mb():.1f} MB")
+            if os.path.exists(staged_error_file_path):
+                os.replace(staged_error_file_path, error_file_path)
+                logging.warning(f"Invalid rows written to {error_file_path}.")
+        else:
+            valid_df, invalid_df = read_and_validate_csv(csv_file_path)
+            load_validated_rows(valid_df, invalid_df, table_name, db_config, error_file_path, load_method,
+                                load_mode, manifest_entry)
 
         # Move the processed CSV file to the archive directory
-        if not os.path.exists(archive_dir):
-            os.makedirs(archive_dir)  # Create archive directory if it doesn't exist
-        
-        archive_path = os.path.join(archive_dir, os.path.basename(csv_file_path))
-        shutil.move(csv_file_path, archive_path)
-        logging.info(f"Source file {csv_file_path} moved to archive directory: {archive_path}.")
+        archive_file(csv_file_path, archive_dir)
     except Exception as e:
         logging.error(f"Error: {e}")
+        if manifest_entry:
+            save_manifest_entry(db_config, manifest_entry, 'FAILED')
+
+def process_csv_files_in_parallel(csv_files, table_name, db_config, archive_dir, error_dir, load_method=LOAD_METHOD,
+                                  chunk_rows=CHUNK_ROWS, workers=WORKERS, db_connections=DB_CONNECTIONS,
+                                  load_mode=LOAD_MODE, file_hashes=None):
+    """
+    Parse and validate files in a pool of worker processes and load them over at most db_connections
+    concurrent connections. Each file is archived by its loader thread only after its own load has committed.
+    """
+    file_hashes = file_hashes or {}
+    with ThreadPoolExecutor(max_workers=db_connections) as load_pool:
+        if chunk_rows:
+            # Streaming keeps memory bounded per file, so each loader thread reads its own file in chunks
+            load_futures = [
+                load_pool.submit(load_csv_to_postgres_with_archiving, csv_file, table_name, db_config,
+                                 archive_dir, error_dir, load_method, chunk_rows, load_mode,
+                                 file_hashes.get(csv_file))
+                for csv_file in csv_files
+            ]
+        else:
+            load_futures = []
+            with ProcessPoolExecutor(max_workers=workers) as parse_pool:
+                parse_futures = {parse_pool.submit(read_and_validate_csv, csv_file): csv_file for csv_file in csv_files}
+
+                # Hand each file to a loader thread as soon as it has been parsed
+                for parse_future in as_completed(parse_futures):
+                    csv_file = parse_futures[parse_future]
+                    try:
+                        valid_df, invalid_df = parse_future.result()
+                    except Exception as e:
+                        # Recorded as in the serial path, so the failure shows in the manifest too
+                        logging.error(f"Error reading {csv_file}: {e}")
+                        manifest_entry = new_manifest_entry(csv_file, file_hashes.get(csv_file), load_mode)
+                        if manifest_entry:
+                            save_manifest_entry(db_config, manifest_entry, 'FAILED')
+                        continue
+                    load_futures.append(
+                        load_pool.submit(load_parsed_file_with_archiving, csv_file, valid_df, invalid_df, table_name,
+                                         db_config, archive_dir, error_dir, load_method, load_mode,
+                                         file_hashes.get(csv_file))
+                    )
+
+        for load_future in as_completed(load_futures):
+            load_future.result()
+
+def prepare_table(table_name, db_config, load_mode=LOAD_MODE):
+    """
+    Get the landing table ready for a load and return the content hashes of the files to skip.
+    """
+    if load_mode == "append":
+        # Keep the table and skip every file whose content the manifest already records as loaded
+        return fetch_loaded_hashes(db_config)
+
+    # Truncate the table before processing files; the manifest is reset with it
+    truncate_table(table_name, db_config)
+    truncate_table(MANIFEST_TABLE, db_config)
+    return set()
+
+def compute_frame_hash(df):
+    """
+    Return a SHA-256 hex digest of a DataFrame's column names and values, the manifest key of a Day
+    frame handed over in process.
+    """
+    digest = hashlib.sha256('\x1f'.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def process_segregated_source(source_file, table_name, db_config, error_dir, load_method=LOAD_METHOD,
+                              load_mode=LOAD_MODE):
+    """
+    Segregate a source file in this process (File_segregator.py) and load its Day frames as they come,
+    without writing Day files or parsing them back. Each Day is validated, loaded and recorded in the
+    manifest like a Day_N file would be; the source file itself is left where it is.
+    """
+    loaded_hashes = prepare_table(table_name, db_config, load_mode)
+    source_name = os.path.splitext(os.path.basename(source_file))[0]
 
-def process_all_csv_files(csv_dir, table_name, db_config, archive_dir, error_dir):
+    for day, day_df in iter_day_frames(source_file):
+        day_df = appointments_schema.conform(day_df)
+        day_name = f"{source_name}_Day_{day}"
+        frame_hash = compute_frame_hash(day_df)
+        if frame_hash in loaded_hashes:
+            logging.info(f"Skipping {day_name}: content {frame_hash} is already loaded.")
+            continue
+        loaded_hashes.add(frame_hash)
+
+        print(f"Loading Day {day} of {source_file}")
+        manifest_entry = {'file_hash': frame_hash, 'file_name': day_name, 'load_mode': load_mode}
+        try:
+            valid_df, invalid_df = validate_source_frame(day_df, day_name)
+            load_validated_rows(valid_df, invalid_df, table_name, db_config, error_file_for(day_name, error_dir),
+                                load_method, load_mode, manifest_entry)
+        except Exception as e:
+            logging.error(f"Error: {e}")
+            save_manifest_entry(db_config, manifest_entry, 'FAILED')
+
+def process_all_csv_files(csv_dir, table_name, db_config, archive_dir, error_dir, load_method=LOAD_METHOD,
+                          chunk_rows=CHUNK_ROWS, workers=WORKERS, db_connections=DB_CONNECTIONS, load_mode=LOAD_MODE):
     """
-    Process all CSV files in the specified directory.
+    Process all source files (SOURCE_PATTERNS) in the specified directory.
     """
-    # Get a list of all CSV files in the directory
-    csv_files = glob.glob(os.path.join(csv_dir, "*.csv"))
+    # Get a list of all source files in the directory
+    csv_files = [path for pattern in SOURCE_PATTERNS for path in glob.glob(os.path.join(csv_dir, pattern))]
 
     if not csv_files:
-        logging.info("No CSV files found to process.")
-        print("No CSV files found to process.")
+        logging.info("No source files found to process.")
+        print("No source files found to process.")
         return
 
-    # Truncate the table before processing files
-    truncate_table(table_name, db_config)
+    loaded_hashes = prepare_table(table_name, db_config, load_mode)
 
+    file_hashes = {}
+    files_to_load = []
     for csv_file in csv_files:
+        file_hash = compute_file_hash(csv_file)
+        if file_hash in loaded_hashes:
+            print(f"Skipping already loaded file: {csv_file}")
+            logging.info(f"Skipping {csv_file}: content {file_hash} is already loaded.")
+            archive_file(csv_file, archive_dir)
+            continue
+        loaded_hashes.add(file_hash)
+        file_hashes[csv_file] = file_hash
+        files_to_load.append(csv_file)
+
+    if workers > 1 and len(files_to_load) > 1:
+        print(f"Processing {len(files_to_load)} files with {workers} workers and {db_connections} DB connections")
+        logging.info(f"Processing {len(files_to_load)} files with {workers} workers and {db_connections} DB connections.")
+        process_csv_files_in_parallel(files_to_load, table_name, db_config, archive_dir, error_dir, load_method,
+                                      chunk_rows, workers, db_connections, load_mode, file_hashes)
+        return
+
+    for csv_file in files_to_load:
         print(f"Processing file: {csv_file}")
         logging.info(f"Processing file: {csv_file}")
-        load_csv_to_postgres_with_archiving(csv_file, table_name, db_config, archive_dir, error_dir)
+        load_csv_to_postgres_with_archiving(csv_file, table_name, db_config, archive_dir, error_dir,
+                                            load_method=load_method, chunk_rows=chunk_rows, load_mode=load_mode,
+                                            file_hash=file_hashes[csv_file])
+
+def parse_args():
+    """
+    Parse command line options for the landing load.
+    """
+    parser = argparse.ArgumentParser(description="Load source CSV files into the landing layer.")
+    parser.add_argument("--load-method", choices=["copy", "insert"], default=LOAD_METHOD,
+                        help="copy: COPY ... FROM STDIN (default), insert: execute_values")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                        help="Stream each file in chunks of this many rows instead of loading it whole")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Worker processes that parse and validate files in parallel")
+    parser.add_argument("--db-connections", type=int, default=DB_CONNECTIONS,
+                        help="Maximum concurrent database connections used to load files in parallel mode")
+    parser.add_argument("--load-mode", choices=["truncate", "append"], default=LOAD_MODE,
+                        help="truncate: empty the table and reload every file (default), "
+                             "append: skip files already in the load manifest and insert only new AppointmentIDs")
+    parser.add_argument("--from-source", metavar="SOURCE_FILE",
+                        help="Segregate this source CSV in process and load its Day frames directly, "
+                             "instead of the files in the source directory")
+    return parser.parse_args()
 
 # Main function to process all files
 if __name__ == "__main__":
-    process_all_csv_files(CSV_DIR, TABLE_NAME, DB_CONFIG, ARCHIVE_DIR, ERROR_DIR)
+    args = parse_args()
+    if args.from_source:
+        process_segregated_source(args.from_source, TABLE_NAME, DB_CONFIG, ERROR_DIR, load_method=args.load_method,
+                                  load_mode=args.load_mode)
+    else:
+        process_all_csv_files(CSV_DIR, TABLE_NAME, DB_CONFIG, ARCHIVE_DIR, ERROR_DIR, load_method=args.load_method,
+                              chunk_rows=args.chunk_rows, workers=args.workers, db_connections=args.db_connections,
+                              load_mode=args.load_mode)
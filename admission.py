@@ -0,0 +1,81 @@
+import asyncio
+
+# Defaults of the admission control: queries running at once per table, queries waiting for one
+# of those slots, and seconds a query waits before it is turned away
+MAX_RUNNING_PER_TABLE = 4
+MAX_QUEUED_PER_TABLE = 32
+QUEUE_TIMEOUT = 10
+
+
+class Overloaded(Exception):
+    """Raised when a query is not admitted: its table's queue is full, or it waited too long."""
+
+
+class _TableSlots:
+    def __init__(self, max_running):
+        self.semaphore = asyncio.Semaphore(max_running)
+        self.waiting = 0
+
+
+class AdmissionControl:
+    """
+    Caps the queries running at once against each table. Callers beyond the cap wait in line,
+    up to max_queued of them and for at most queue_timeout seconds; anyone else is refused at once.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING_PER_TABLE, max_queued=MAX_QUEUED_PER_TABLE,
+                 queue_timeout=QUEUE_TIMEOUT):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._tables = {}
+
+    async def acquire(self, key):
+        """
+        Wait for a slot of the table identified by key; every successful acquire needs a release(key).
+        """
+        slots = self._tables.get(key)
+        if slots is None:
+            slots = self._tables[key] = _TableSlots(self.max_running)
+        if slots.semaphore.locked() and slots.waiting >= self.max_queued:
+            raise Overloaded(f"{slots.waiting} queries already waiting for {key[0]}.{key[1]}.")
+        slots.waiting += 1
+        try:
+            await asyncio.wait_for(slots.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded(f"No query slot for {key[0]}.{key[1]} within {self.queue_timeout}s.")
+        finally:
+            slots.waiting -= 1
+
+    def release(self, key):
+        self._tables[key].semaphore.release()
+
+
+class SingleFlight:
+    """
+    Runs a coroutine function once for all callers asking for the same key at the same time:
+    callers arriving while it runs wait for that run and get its result (or its exception).
+    The run goes on when the caller that started it goes away.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, key, func):
+        """
+        Return (result of func(), whether it was shared with a run started by another caller).
+        """
+        task = self._flights.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(func())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Nobody may be left waiting; fetching the exception keeps asyncio from reporting it as unhandled
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,85 @@
+from pagination import quote_ident
+
+# Table aggregated by /aggregate (the latest version of every appointment), and the materialized summary of it that
+# LND_to_CORE refreshes after each load (see Database_setup.sql)
+SOURCE_SCHEMA = 'FINAL_LAYER'
+SOURCE_TABLE = 'pat_attendance_core'
+SUMMARY_TABLE = 'pat_attendance_summary'
+
+# Age bands of the age_band dimension; keep in step with the AgeBand column of pat_attendance_summary
+AGE_BAND_SQL = ("CASE WHEN Age < 18 THEN '0-17' WHEN Age < 35 THEN '18-34' WHEN Age < 50 THEN '35-49' "
+                "WHEN Age < 65 THEN '50-64' ELSE '65+' END")
+
+# Dimensions a client can group by -> column of the summary (and of the latest rows, see current_rows_sql)
+DIMENSIONS = {
+    'neighbourhood': 'neighbourhood',
+    'gender': 'gender',
+    'age_band': 'ageband',
+    'sms_received': 'smsreceivedstatus',
+    'scholarship': 'scholarshipstatus',
+    'hipertension': 'hipertensionstatus',
+    'diabetes': 'diabetesstatus',
+    'alcoholism': 'alcoholismstatus',
+    'handcap': 'handcapstatus',
+}
+
+# Measures a client can ask for, computed from the additive columns of the summary
+MEASURES = {
+    'appointments': 'sum(appointments)::bigint',
+    'no_shows': 'sum(noshows)::bigint',
+    'no_show_rate': 'round(sum(noshows)::numeric / nullif(sum(appointments), 0), 4)',
+    'avg_age': 'round(sum(agesum)::numeric / nullif(sum(appointments), 0), 2)',
+}
+
+
+class InvalidAggregate(ValueError):
+    """Raised when an aggregation asks for a dimension or measure outside the whitelist."""
+
+
+def parse_names(value, allowed, parameter):
+    """
+    Split a comma-separated query parameter and check every name against allowed.
+    """
+    names = [name.strip().lower() for name in (value or '').split(',') if name.strip()]
+    for name in names:
+        if name not in allowed:
+            raise InvalidAggregate(f"Unknown {parameter} '{name}', expected one of: {', '.join(allowed)}.")
+    if len(set(names)) != len(names):
+        raise InvalidAggregate(f"{parameter} lists a name twice.")
+    return names
+
+
+def current_rows_sql():
+    """
+    The latest version of every appointment in the source table with the columns of the summary, one
+    appointment per row, so a query written for the summary also runs against the live table. Only one
+    row per patient is active, so the active rows alone would leave out all but their latest appointment.
+    """
+    return f"""(
+        SELECT Neighbourhood, Gender, {AGE_BAND_SQL} AS AgeBand, SMSReceivedStatus, ScholarshipStatus,
+               HipertensionStatus, DiabetesStatus, AlcoholismStatus, HandcapStatus,
+               1 AS Appointments, NoShow::int AS NoShows, Age AS AgeSum
+        FROM (
+            SELECT DISTINCT ON (AppointmentID) *
+            FROM {quote_ident(SOURCE_SCHEMA)}.{quote_ident(SOURCE_TABLE)}
+            ORDER BY AppointmentID, RecordStartDate DESC
+        ) latest_appointments
+    ) current_rows"""
+
+
+def build_aggregate_query(dimensions, measures, from_summary=True):
+    """
+    SELECT grouping the appointments (latest versions) on dimensions and computing measures, read from the
+    materialized summary or, when from_summary is false, from the source table itself.
+    """
+    columns = [f'{DIMENSIONS[name]} AS {quote_ident(name)}' for name in dimensions]
+    columns += [f'{MEASURES[name]} AS {quote_ident(name)}' for name in measures]
+    if from_summary:
+        source = f'{quote_ident(SOURCE_SCHEMA)}.{quote_ident(SUMMARY_TABLE)}'
+    else:
+        source = current_rows_sql()
+    query = f"SELECT {', '.join(columns)} FROM {source}"
+    if dimensions:
+        positions = ', '.join(str(position) for position in range(1, len(dimensions) + 1))
+        query += f" GROUP BY {positions} ORDER BY {positions}"
+    return query
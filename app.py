@@ -1,64 +1,436 @@
 from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from typing import Optional
-import psycopg2
+import asyncio
 import logging
+import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 
-# Initialize FastAPI app
-app = FastAPI()
+from admission import (MAX_QUEUED_PER_TABLE, MAX_RUNNING_PER_TABLE, QUEUE_TIMEOUT, AdmissionControl, Overloaded,
+                       SingleFlight)
+from aggregates import (DIMENSIONS, MEASURES, SOURCE_SCHEMA, SOURCE_TABLE, SUMMARY_TABLE, InvalidAggregate,
+                        build_aggregate_query, parse_names)
+from catalog import CATALOG_TTL, SchemaCatalog
+from database import ACQUIRE_TIMEOUT, POOL_SIZES, create_async_pool
+from exports import FORMATS, require_pyarrow, stream_arrow, stream_copy_csv, stream_ndjson
+from log_pipeline import configure_logging
+from metrics import Counter, Histogram, current_timings, render_metrics, start_request_timings
+from pagination import InvalidCursor, decode_cursor, encode_cursor, quote_ident
+from result_cache import CACHE_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL, ResultCache, not_modified, probe_freshness
+from serialization import column_types, dumps, row_encoder
 
 # Generate log file name with timestamp
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 log_file_path = f"/home/starlord/ETL_PostgreSQL/Subhasis_Tasks/postGreSQL-DataPipeLine-API/fastapi_retrieve_{timestamp}.log"
 
-# Configure logging
-logging.basicConfig(
-    filename=log_file_path,
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s]: %(message)s",
-)
+# Configure logging: records go through a queue to a listener thread, never blocking a request on the disk
+configure_logging(log_file_path, "%(asctime)s [%(levelname)s]: %(message)s")
+
+# Database queried by the API; connection details live in database.py
+DB_NAME = "core"
+DB_PROFILE = "api"
+
+# Async connection pool of the API, overridable through the environment of the server process
+POOL_MIN_SIZE = int(os.environ.get("API_POOL_MIN_SIZE", POOL_SIZES[DB_NAME]['minconn']))
+POOL_MAX_SIZE = int(os.environ.get("API_POOL_MAX_SIZE", POOL_SIZES[DB_NAME]['maxconn']))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get("API_POOL_ACQUIRE_TIMEOUT", ACQUIRE_TIMEOUT))  # seconds
+
+# Largest page a client can ask for with limit
+MAX_PAGE_SIZE = 10000
+
+# Rows pulled per round trip from the server-side cursor behind a streamed response
+STREAM_PREFETCH = 1000
+
+# Seconds the cached catalog of the database (schemas, tables, columns, indexes) is trusted
+CATALOG_CACHE_TTL = float(os.environ.get("API_CATALOG_TTL", CATALOG_TTL))
+
+# Cache of rendered JSON results, invalidated when the table's load generation moves
+RESULT_CACHE_ENTRIES = int(os.environ.get("API_RESULT_CACHE_ENTRIES", CACHE_ENTRIES))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("API_RESULT_CACHE_MAX_BYTES", CACHE_MAX_BYTES))
+RESULT_CACHE_TTL = float(os.environ.get("API_RESULT_CACHE_TTL", CACHE_TTL))  # seconds
+
+# Requests slower than this many seconds are logged as warnings with their query; 0 disables the slow log
+SLOW_REQUEST_SECONDS = float(os.environ.get("API_SLOW_REQUEST_SECONDS", 0))
+
+# Admission control: queries running at once per table, queries waiting for one of those slots and
+# seconds they wait before a 503; identical JSON queries arriving together share one execution
+QUERY_SLOTS_PER_TABLE = int(os.environ.get("API_QUERY_SLOTS_PER_TABLE", MAX_RUNNING_PER_TABLE))
+QUERY_QUEUE_PER_TABLE = int(os.environ.get("API_QUERY_QUEUE_PER_TABLE", MAX_QUEUED_PER_TABLE))
+QUERY_QUEUE_TIMEOUT = float(os.environ.get("API_QUERY_QUEUE_TIMEOUT", QUEUE_TIMEOUT))  # seconds
+RETRY_AFTER_SECONDS = 5
 
-# Database configuration
-DB_CONFIG = {
-    "user": "postgres",
-    "password": "postgres",
-    "host": "localhost",
-    "port": "5432",
-    "dbname": "core",
-}
+# Longest a query may run (seconds); a request can ask for less with timeout
+STATEMENT_TIMEOUT = float(os.environ.get("API_STATEMENT_TIMEOUT", 30))
 
+# Largest JSON result sent without limit; bigger results are refused with 413 (0 disables the guard)
+MAX_RESULT_ROWS = int(os.environ.get("API_MAX_RESULT_ROWS", 100000))
 
-def get_db_connection():
+# SCD2 history table served by /snapshot, and the key its pages are ordered on
+# (the partial index idx_current_patient covers the active rows in that order)
+SNAPSHOT_SCHEMA = "FINAL_LAYER"
+SNAPSHOT_TABLE = "pat_attendance_core"
+SNAPSHOT_KEY = ["patientid", "appointmentid"]
+
+# Metrics served on /metrics (per worker process)
+REQUESTS = Counter("api_requests_total", "Requests served.", ["path", "schema", "table", "status"])
+REQUEST_DURATION = Histogram("api_request_duration_seconds", "Time to serve a request, up to the last byte of the body.",
+                             ["path", "schema", "table", "status"])
+PHASE_DURATION = Histogram("api_request_phase_duration_seconds",
+                           "Time spent per phase of a request: acquire, catalog, probe, queue, coalesced, execute, "
+                           "fetch, serialize.",
+                           ["phase", "schema", "table"])
+ROWS_RETURNED = Counter("api_rows_returned_total", "Rows returned (not counted for format=csv).", ["schema", "table"])
+BYTES_SENT = Counter("api_response_bytes_total", "Response body bytes sent.", ["path", "schema", "table", "status"])
+COALESCED_REQUESTS = Counter("api_coalesced_requests_total",
+                             "JSON requests answered by sharing an identical query already running.", ["schema", "table"])
+ADMISSION_REJECTED = Counter("api_admission_rejected_total",
+                             "Queries refused because their table's query slots and queue were full.", ["schema", "table"])
+RESULT_CACHE_REQUESTS = Counter("api_result_cache_requests_total",
+                                "JSON results by cache outcome: hit, miss, not_modified, uncacheable.", ["result"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     """
-    Establish and return a connection to the PostgreSQL database.
+    Open the connection pool when the server starts and close it when the server stops.
     """
+    app.state.db_pool = await create_async_pool(DB_NAME, DB_PROFILE, POOL_MIN_SIZE, POOL_MAX_SIZE)
+    app.state.catalog = SchemaCatalog(CATALOG_CACHE_TTL, POOL_ACQUIRE_TIMEOUT)
+    app.state.result_cache = ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+    app.state.admission = AdmissionControl(QUERY_SLOTS_PER_TABLE, QUERY_QUEUE_PER_TABLE, QUERY_QUEUE_TIMEOUT)
+    app.state.single_flight = SingleFlight()
     try:
-        conn = psycopg2.connect(
-            dbname=DB_CONFIG["dbname"],
-            user=DB_CONFIG["user"],
-            password=DB_CONFIG["password"],
-            host=DB_CONFIG["host"],
-            port=DB_CONFIG["port"],
-        )
-        return conn
+        yield
+    finally:
+        await app.state.db_pool.close()
+
+
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan)
+
+
+async def acquire_db_connection():
+    """
+    Borrow a connection to the PostgreSQL database from the async pool; give it back with release_db_connection.
+    """
+    try:
+        with current_timings().phase("acquire"):
+            return await app.state.db_pool.acquire(timeout=POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.error(f"No database connection free after {POOL_ACQUIRE_TIMEOUT}s.")
+        raise HTTPException(status_code=503, detail="Database busy, retry later.")
     except Exception as e:
         logging.error(f"Error connecting to database: {e}")
         raise HTTPException(status_code=500, detail="Failed to connect to the database.")
 
 
+async def release_db_connection(conn):
+    await app.state.db_pool.release(conn)
+
+
+@asynccontextmanager
+async def get_db_connection():
+    """
+    Borrow a connection to the PostgreSQL database from the async pool.
+    """
+    conn = await acquire_db_connection()
+    try:
+        yield conn
+    finally:
+        await release_db_connection(conn)
+
+
+async def catalog_call(method, *args):
+    """
+    Run a SchemaCatalog method, turning a failure to reach the database into an HTTP error.
+    """
+    try:
+        with current_timings().phase("catalog"):
+            return await method(app.state.db_pool, *args)
+    except asyncio.TimeoutError:
+        logging.error(f"No database connection free after {POOL_ACQUIRE_TIMEOUT}s.")
+        raise HTTPException(status_code=503, detail="Database busy, retry later.")
+    except Exception as e:
+        logging.error(f"Error loading the catalog: {e}")
+        raise HTTPException(status_code=500, detail="Failed to read the database catalog.")
+
+
+def resolve_column(table_info, name: str, parameter: str) -> str:
+    """
+    Check a column name given in a query parameter against the cached catalog and return it as stored.
+    """
+    column = table_info.resolve_column(name)
+    if column is None:
+        raise HTTPException(status_code=400, detail=f"Unknown column '{name}' in {parameter}.")
+    return column
+
+
+async def stream_and_release(conn, body, statement_timeout: float, table_key):
+    """
+    Send a streamed response body produced from conn, inside one read transaction (server-side
+    cursors need it). Owns conn and the query slot of table_key, and releases both once the response
+    is finished or the client went away.
+    """
+    bytes_sent = 0
+    try:
+        async with conn.transaction(readonly=True):
+            await set_statement_timeout(conn, statement_timeout)
+            async for chunk in body:
+                bytes_sent += len(chunk)
+                yield chunk
+        logging.info(f"Streamed {bytes_sent} bytes.")
+    except Exception as e:
+        # Headers are already sent, so the client only sees a truncated body
+        logging.error(f"Error streaming data after {bytes_sent} bytes: {e}")
+        raise
+    finally:
+        # The slot goes back first: on a client disconnect the await below is cancelled in turn
+        release_query(*table_key)
+        await release_db_connection(conn)
+
+
+def parse_time(value: str, name: str) -> datetime:
+    """
+    Parse a start_time/end_time query parameter (YYYY-MM-DD, optionally with a time).
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS.")
+
+
+def record_request(request: Request, status_code: int, timings):
+    """
+    Log the timings of a finished request and add them to the metrics.
+    """
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    status = str(status_code)
+    elapsed = timings.elapsed()
+    REQUESTS.inc(path=path, schema=timings.schema, table=timings.table, status=status)
+    REQUEST_DURATION.observe(elapsed, path=path, schema=timings.schema, table=timings.table, status=status)
+    BYTES_SENT.inc(timings.bytes, path=path, schema=timings.schema, table=timings.table, status=status)
+    if timings.rows:
+        ROWS_RETURNED.inc(timings.rows, schema=timings.schema, table=timings.table)
+    for phase, seconds in timings.phases.items():
+        PHASE_DURATION.observe(seconds, phase=phase, schema=timings.schema, table=timings.table)
+
+    logging.info(f"Response status: {status_code} in {timings.describe()}")
+    if SLOW_REQUEST_SECONDS and elapsed > SLOW_REQUEST_SECONDS:
+        logging.warning(f"Slow request ({elapsed:.3f}s > {SLOW_REQUEST_SECONDS}s): {request.method} {request.url} "
+                        f"query={timings.query}")
+
+
+async def count_body(request: Request, response, body_iterator, timings):
+    """
+    Pass the response body through, counting its bytes, and record the request once it is fully sent.
+    """
+    try:
+        async for chunk in body_iterator:
+            timings.bytes += len(chunk)
+            yield chunk
+    finally:
+        record_request(request, response.status_code, timings)
+
+
+async def admit_query(schema: str, table: str):
+    """
+    Wait for one of the query slots of schema.table; the caller must release it with release_query.
+    """
+    try:
+        with current_timings().phase("queue"):
+            await app.state.admission.acquire((schema, table))
+    except Overloaded as e:
+        ADMISSION_REJECTED.inc(schema=schema, table=table)
+        logging.warning(f"Query on {schema}.{table} not admitted: {e}")
+        raise HTTPException(status_code=503, detail=f"Too many queries on this table, retry later. {e}",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+def release_query(schema: str, table: str):
+    app.state.admission.release((schema, table))
+
+
+async def set_statement_timeout(conn, seconds: float):
+    """
+    Limit the statements of the current transaction to seconds; PostgreSQL cancels them past it.
+    """
+    await conn.execute("SELECT set_config('statement_timeout', $1, true)", f"{int(seconds * 1000)}ms")
+
+
+def query_timeout(timeout: Optional[float]) -> float:
+    """
+    statement_timeout of a request: what the client asked for, never more than STATEMENT_TIMEOUT.
+    """
+    return min(timeout, STATEMENT_TIMEOUT) if timeout else STATEMENT_TIMEOUT
+
+
+async def fetch_json(schema: str, table: str, query: str, params: list, key_columns: list, limit: Optional[int],
+                     statement_timeout: float, cache_key, freshness, validators: dict):
+    """
+    Run a query once it is admitted and render the JSON body, caching it under the freshness token.
+    Returns (body, headers, rows).
+    """
+    timings = current_timings()
+    await admit_query(schema, table)
+    try:
+        async with get_db_connection() as conn:
+            async with conn.transaction(readonly=True):
+                await set_statement_timeout(conn, statement_timeout)
+                # execute: parse and plan; fetch: run and receive the rows
+                with timings.phase("execute"):
+                    statement = await conn.prepare(query)
+                    columns = column_types(statement.get_attributes())
+                with timings.phase("fetch"):
+                    rows = await statement.fetch(*params)
+    except Exception as e:
+        if getattr(e, "sqlstate", None) == "57014":  # query_canceled
+            logging.warning(f"Query on {schema}.{table} cancelled after {statement_timeout}s.")
+            raise HTTPException(status_code=504, detail=f"Query exceeded its statement_timeout of {statement_timeout}s.")
+        raise
+    finally:
+        release_query(schema, table)
+
+    if not limit and MAX_RESULT_ROWS and len(rows) > MAX_RESULT_ROWS:
+        raise HTTPException(status_code=413, detail=f"Result exceeds {MAX_RESULT_ROWS} rows; page through it with "
+                                                    f"limit and cursor, or use a streamed format.")
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key_columns, [rows[-1][column] for column in key_columns])
+
+    # Convert the result to JSON format, straight from the result rows
+    with timings.phase("serialize"):
+        encode_row = row_encoder(columns)
+        data = [encode_row(row) for row in rows]
+        if not limit:
+            body = dumps({"data": data})
+        else:
+            body = dumps({"data": data, "next_cursor": next_cursor})
+
+    logging.info(f"Query executed successfully. Rows retrieved: {len(data)}")
+    headers = dict(validators)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if freshness is not None:
+        app.state.result_cache.put(cache_key, freshness.token, body, headers, len(data))
+    return body, headers, len(data)
+
+
+async def serve_query(request: Request, snapshot, schema: str, table: str, query: str, params: list,
+                      key_columns: list, limit: Optional[int], format: str, filename: str,
+                      timeout: Optional[float] = None):
+    """
+    Run a validated query on schema.table and send its rows: streamed in one of FORMATS, or as JSON
+    (a page with next_cursor on key_columns when limit is given) with ETag/Last-Modified, 304 answers
+    and the result cache. Queries wait for a slot of their table (admission control), run under a
+    statement_timeout, and identical JSON queries arriving together share one execution.
+    """
+    timings = current_timings()
+    if format in ("parquet", "arrow"):
+        try:
+            require_pyarrow()
+        except ImportError:
+            raise HTTPException(status_code=501, detail=f"format={format} needs pyarrow installed on the server.")
+    if limit:
+        # One extra row tells whether there is a next page
+        query += f" LIMIT {limit + 1}" if format == "json" else f" LIMIT {limit}"
+    elif format == "json" and MAX_RESULT_ROWS:
+        # Row-limit guard: one row past the maximum is enough to refuse the result
+        query += f" LIMIT {MAX_RESULT_ROWS + 1}"
+    statement_timeout = query_timeout(timeout)
+
+    logging.info(f"Executing query: {query} with params={params}")
+    timings.query = query
+
+    if format in FORMATS:
+        await admit_query(schema, table)
+        try:
+            conn = await acquire_db_connection()
+        except BaseException:
+            release_query(schema, table)
+            raise
+        try:
+            # Prepared first, so a bad query still gets an error status instead of a truncated body
+            with timings.phase("execute"):
+                statement = await conn.prepare(query)
+            if format == "ndjson":
+                body = stream_ndjson(statement, params, STREAM_PREFETCH)
+            elif format == "csv":
+                body = stream_copy_csv(conn, query, params)
+            else:
+                body = stream_arrow(statement, params, format)
+        except BaseException:
+            release_query(schema, table)
+            await release_db_connection(conn)
+            raise
+        media_type, extension = FORMATS[format]
+        # The connection and the query slot move to the response body, released when the stream ends
+        return StreamingResponse(
+            stream_and_release(conn, body, statement_timeout, (schema, table)),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+        )
+
+    # Conditional GET and result cache: one cheap probe tells whether the table changed
+    cache_key = (query, tuple(params))
+    validators = {}
+    async with get_db_connection() as conn:
+        with timings.phase("probe"):
+            freshness = await probe_freshness(conn, snapshot, schema, table)
+    if freshness is None:
+        RESULT_CACHE_REQUESTS.inc(result="uncacheable")
+    else:
+        etag = freshness.etag(cache_key)
+        validators["ETag"] = etag
+        if freshness.last_modified is not None:
+            validators["Last-Modified"] = freshness.http_last_modified()
+        if not_modified(request.headers, etag, freshness):
+            RESULT_CACHE_REQUESTS.inc(result="not_modified")
+            logging.info("Not modified since the client's copy.")
+            return Response(status_code=304, headers=validators)
+        entry = app.state.result_cache.get(cache_key, freshness.token)
+        if entry is not None:
+            RESULT_CACHE_REQUESTS.inc(result="hit")
+            timings.rows = entry.rows
+            logging.info("Served from the result cache.")
+            return Response(entry.body, media_type="application/json", headers=entry.headers)
+        RESULT_CACHE_REQUESTS.inc(result="miss")
+
+    # Single flight: identical queries on the same version of the table share one execution
+    flight_key = (cache_key, freshness.token if freshness is not None else None)
+    started = time.perf_counter()
+    (body, headers, rows), shared = await app.state.single_flight.do(
+        flight_key,
+        lambda: fetch_json(schema, table, query, params, key_columns, limit, statement_timeout,
+                           cache_key, freshness, validators)
+    )
+    if shared:
+        timings.record("coalesced", time.perf_counter() - started)
+        COALESCED_REQUESTS.inc(schema=schema, table=table)
+        logging.info("Shared the result of an identical query already running.")
+    timings.rows = rows
+    return Response(body, media_type="application/json", headers=headers)
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """
-    Middleware to log incoming requests.
+    Middleware to log incoming requests, with the time spent per phase, rows and bytes sent.
     """
+    timings = start_request_timings()
     logging.info(f"Request: {request.method} {request.url}")
     response = await call_next(request)
-    logging.info(f"Response status: {response.status_code}")
+    response.body_iterator = count_body(request, response, response.body_iterator, timings)
     return response
 
 
 @app.get("/retrieve-data")
 async def retrieve_data(
+    request: Request,
     schema: str = Query(..., description="Schema name to query"),
     table: Optional[str] = Query(None, description="Table name to query"),
     timestamp_column: Optional[str] = Query(None, description="Name of the timestamp column for filtering"),
@@ -66,67 +438,213 @@ async def retrieve_data(
     end_time: Optional[str] = Query(None, description="End time for filtering (YYYY-MM-DD)"),
     id_column: Optional[str] = Query(None, description="ID column name for filtering"),
     id_value: Optional[int] = Query(None, description="ID value for filtering"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; the response carries next_cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    order_by: Optional[str] = Query(None, description="Comma-separated unique key columns to page on (default: primary key)"),
+    format: str = Query("json", pattern="^(json|ndjson|csv|parquet|arrow)$",
+                        description="json, or a format streamed as rows are read: ndjson, csv, parquet, arrow"),
+    timeout: Optional[float] = Query(None, gt=0, description=f"Seconds the query may run (at most {STATEMENT_TIMEOUT})"),
 ):
     """
     Retrieve data from PostgreSQL based on schema, table, timestamp, and ID filters.
+    Large tables can be read page by page (limit and cursor, keyset pagination on order_by)
+    or streamed as NDJSON, CSV, Parquet or Arrow IPC without holding the result in memory.
+    JSON results carry ETag/Last-Modified, are answered 304 when unchanged and are served from
+    the result cache while the table's data has not changed.
     """
+    timings = current_timings()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Case 1: If only schema is provided, retrieve all tables in the schema
+        # Case 1: If only schema is provided, retrieve all tables in the schema (from the cached catalog)
         if not table:
-            query = """
-                SELECT table_name
-                FROM information_schema.tables
-                WHERE table_schema = %s
-            """
-            logging.info(f"Executing query: {query} with schema={schema}")
-            cursor.execute(query, (schema,))
-            tables = cursor.fetchall()
-            table_list = [table[0] for table in tables]
-            cursor.close()
-            conn.close()
+            snapshot = await catalog_call(app.state.catalog.get)
+            table_list = snapshot.tables(schema)
+            if schema in snapshot.schemas:
+                timings.schema = schema
             logging.info(f"Retrieved tables: {table_list}")
             return {"tables": table_list}
 
-        # Case 2: If schema and table are provided, fetch data from the table
-        schema_quoted = f'"{schema}"'
-        table_quoted = f'"{table}"'
-        query = f"SELECT * FROM {schema_quoted}.{table_quoted}"
+        # Case 2: If schema and table are provided, fetch data from the table.
+        # Every identifier is checked against the cached catalog before any SQL is sent.
+        snapshot, table_info = await catalog_call(app.state.catalog.find_table, schema, table)
+        if table_info is None:
+            raise HTTPException(status_code=404, detail=f"Table '{schema}.{table}' not found.")
+        timings.schema, timings.table = schema, table
+        query = f"SELECT * FROM {quote_ident(schema)}.{quote_ident(table)}"
 
 
         # Add optional filters
         filters = []
         params = []
+        filter_columns = []
 
         if timestamp_column and start_time and end_time:
-            filters.append(f"{timestamp_column} BETWEEN %s AND %s")
-            params.extend([start_time, end_time])
+            column = resolve_column(table_info, timestamp_column, "timestamp_column")
+            filters.append(f"{quote_ident(column)} BETWEEN ${len(params) + 1} AND ${len(params) + 2}")
+            params.extend([parse_time(start_time, "start_time"), parse_time(end_time, "end_time")])
+            filter_columns.append(column)
 
         if id_column and id_value:
-            filters.append(f"{id_column} = %s")
+            column = resolve_column(table_info, id_column, "id_column")
+            filters.append(f"{quote_ident(column)} = ${len(params) + 1}")
             params.append(id_value)
+            filter_columns.append(column)
+
+        for column in filter_columns:
+            if column not in table_info.indexed_columns:
+                logging.warning(f"Filter on {schema}.{table}.{column} is not backed by an index.")
+
+        # Keyset pagination: order on a unique key and continue after the last key returned
+        key_columns = []
+        if limit or cursor or order_by:
+            if order_by:
+                key_columns = [resolve_column(table_info, column.strip(), "order_by")
+                               for column in order_by.split(",") if column.strip()]
+            else:
+                key_columns = table_info.primary_key
+            if not key_columns:
+                raise HTTPException(status_code=400, detail="Table has no primary key, pass order_by.")
+            keys_quoted = ", ".join(quote_ident(column) for column in key_columns)
+
+            if cursor:
+                try:
+                    after = decode_cursor(cursor, key_columns)
+                except InvalidCursor as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+                placeholders = ", ".join(f"${len(params) + i + 1}" for i in range(len(after)))
+                filters.append(f"({keys_quoted}) > ({placeholders})")
+                params.extend(after)
 
         # Append filters to the query
         if filters:
             query += " WHERE " + " AND ".join(filters) 
+        if key_columns:
+            query += f" ORDER BY {keys_quoted}"
+        return await serve_query(request, snapshot, schema, table, query, params, key_columns, limit,
+                                 format, table, timeout)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Error retrieving data: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error.")
+
+
+@app.get("/snapshot")
+async def patient_snapshot(
+    request: Request,
+    as_of: Optional[str] = Query(None, description="Point in time (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS); default: now"),
+    patient_id: Optional[int] = Query(None, description="Only this patient"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; the response carries next_cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    format: str = Query("json", pattern="^(json|ndjson|csv|parquet|arrow)$",
+                        description="json, or a format streamed as rows are read: ndjson, csv, parquet, arrow"),
+    timeout: Optional[float] = Query(None, gt=0, description=f"Seconds the query may run (at most {STATEMENT_TIMEOUT})"),
+):
+    """
+    State of the patients in the SCD2 history of pat_attendance_core, ordered on PatientId and AppointmentID.
+    Without as_of, the active version of every patient (IsActive, read through a partial index so the
+    history is not scanned); with as_of, the versions valid then: RecordStartDate <= as_of < RecordEndDate,
+    where a missing RecordEndDate means still valid.
+    """
+    timings = current_timings()
+    try:
+        snapshot, table_info = await catalog_call(app.state.catalog.find_table, SNAPSHOT_SCHEMA, SNAPSHOT_TABLE)
+        if table_info is None:
+            raise HTTPException(status_code=404, detail=f"Table '{SNAPSHOT_SCHEMA}.{SNAPSHOT_TABLE}' not found.")
+        timings.schema, timings.table = SNAPSHOT_SCHEMA, SNAPSHOT_TABLE
+        query = f"SELECT * FROM {quote_ident(SNAPSHOT_SCHEMA)}.{quote_ident(SNAPSHOT_TABLE)}"
 
-        logging.info(f"Executing query: {query} with params={params}")
-        cursor.execute(query, tuple(params))
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
+        filters = []
+        params = []
+        if as_of is None:
+            filters.append("isactive")
+        else:
+            params.append(parse_time(as_of, "as_of"))
+            filters.append("recordstartdate <= $1 AND (recordenddate IS NULL OR recordenddate > $1)")
 
-        # Convert the result to JSON format
-        data = [dict(zip(columns, row)) for row in rows]
+        if patient_id is not None:
+            filters.append(f"patientid = ${len(params) + 1}")
+            params.append(patient_id)
 
-        cursor.close()
-        conn.close()
+        keys_quoted = ", ".join(quote_ident(column) for column in SNAPSHOT_KEY)
+        if cursor:
+            try:
+                after = decode_cursor(cursor, SNAPSHOT_KEY)
+            except InvalidCursor as e:
+                raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+            placeholders = ", ".join(f"${len(params) + i + 1}" for i in range(len(after)))
+            filters.append(f"({keys_quoted}) > ({placeholders})")
+            params.extend(after)
 
-        logging.info(f"Query executed successfully. Rows retrieved: {len(data)}")
-        return {"data": data}
+        query += " WHERE " + " AND ".join(filters) + f" ORDER BY {keys_quoted}"
+        filename = f"{SNAPSHOT_TABLE}_{'current' if as_of is None else 'as_of'}"
+        return await serve_query(request, snapshot, SNAPSHOT_SCHEMA, SNAPSHOT_TABLE, query, params,
+                                 SNAPSHOT_KEY, limit, format, filename, timeout)
     except HTTPException as e:
         raise e
     except Exception as e:
-        logging.error(f"Error retrieving data: {e}")
+        logging.error(f"Error retrieving the snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error.")
+
+
+@app.get("/aggregate")
+async def aggregate(
+    request: Request,
+    group_by: Optional[str] = Query(None, description=f"Comma-separated dimensions: {', '.join(DIMENSIONS)}"),
+    measures: Optional[str] = Query(None, description=f"Comma-separated measures (default: all): {', '.join(MEASURES)}"),
+    format: str = Query("json", pattern="^(json|ndjson|csv|parquet|arrow)$",
+                        description="json, or a format streamed as rows are read: ndjson, csv, parquet, arrow"),
+    timeout: Optional[float] = Query(None, gt=0, description=f"Seconds the query may run (at most {STATEMENT_TIMEOUT})"),
+):
+    """
+    Aggregate the appointments of pat_attendance_core (their latest versions) in PostgreSQL, e.g. the
+    no-show rate by neighbourhood or age band. Read from the materialized summary LND_to_CORE refreshes
+    after each load, or from the table itself while the summary does not exist.
+    """
+    timings = current_timings()
+    try:
+        try:
+            dimensions = parse_names(group_by, DIMENSIONS, "group_by")
+            measure_names = parse_names(measures, MEASURES, "measures") or list(MEASURES)
+        except InvalidAggregate as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        snapshot, table_info = await catalog_call(app.state.catalog.find_table, SOURCE_SCHEMA, SUMMARY_TABLE)
+        table = SUMMARY_TABLE
+        if table_info is None:
+            snapshot, table_info = await catalog_call(app.state.catalog.find_table, SOURCE_SCHEMA, SOURCE_TABLE)
+            table = SOURCE_TABLE
+            if table_info is None:
+                raise HTTPException(status_code=404, detail=f"Table '{SOURCE_SCHEMA}.{SOURCE_TABLE}' not found.")
+            logging.warning(f"Summary {SOURCE_SCHEMA}.{SUMMARY_TABLE} not found, aggregating {SOURCE_TABLE} itself.")
+        timings.schema, timings.table = SOURCE_SCHEMA, table
+
+        query = build_aggregate_query(dimensions, measure_names, from_summary=table == SUMMARY_TABLE)
+        filename = "_".join(["aggregate"] + dimensions)
+        return await serve_query(request, snapshot, SOURCE_SCHEMA, table, query, [], [], None,
+                                 format, filename, timeout)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Error aggregating: {e}")
         raise HTTPException(status_code=500, detail="Internal server error.")
+
+
+@app.post("/catalog/refresh")
+async def refresh_catalog():
+    """
+    Reload the cached catalog now, e.g. right after a table or column was added.
+    """
+    snapshot = await catalog_call(app.state.catalog.refresh)
+    return {
+        "schemas": len(snapshot.schemas),
+        "tables": sum(len(tables) for tables in snapshot.schemas.values()),
+        "loaded_at": snapshot.loaded_at.isoformat()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Request counters and latency histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,161 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Columns of the appointments feed, in the order of "LANDING_LAYER".appointments (see Database_setup.sql):
+# (landing column, CSV header, pandas dtype the column is read with)
+COLUMNS = [
+    ('patientid', 'PatientId', 'str'),  # NUMERIC: kept as text, so no digit is lost to float64
+    ('appointmentid', 'AppointmentID', 'int64'),  # BIGINT
+    ('gender', 'Gender', 'category'),  # CHAR(1)
+    ('scheduledday', 'ScheduledDay', 'str'),  # TIMESTAMP, see parse_timestamps
+    ('appointmentday', 'AppointmentDay', 'str'),  # TIMESTAMP, see parse_timestamps
+    ('age', 'Age', 'int32'),  # INTEGER
+    ('neighbourhood', 'Neighbourhood', 'category'),  # VARCHAR(255)
+    ('scholarship', 'Scholarship', 'int32'),  # INTEGER
+    ('hipertension', 'Hipertension', 'int32'),  # INTEGER
+    ('diabetes', 'Diabetes', 'int32'),  # INTEGER
+    ('alcoholism', 'Alcoholism', 'int32'),  # INTEGER
+    ('handcap', 'Handcap', 'int32'),  # INTEGER
+    ('sms_received', 'SMS_received', 'int32'),  # INTEGER
+    ('no_show', 'No-show', 'str'),  # BOOLEAN, 'Yes' / 'No'
+]
+
+LANDING_COLUMNS = [column for column, _, _ in COLUMNS]
+
+# Other spellings of the headers: the Day files of File_segregator.py write No_show, and frames
+# already renamed carry the landing names
+HEADER_ALIASES = {'No_show': 'no_show'}
+
+# Header (any spelling) -> landing column
+HEADERS = {
+    **{header: column for column, header, _ in COLUMNS},
+    **{column: column for column in LANDING_COLUMNS},
+    **HEADER_ALIASES,
+}
+
+# Header (any spelling) -> dtype it is read with, and the same with the integers read as text, for
+# files where an integer column has missing or non-integer values (rejected later by validation)
+_COLUMN_DTYPES = {column: dtype for column, _, dtype in COLUMNS}
+DTYPES = {header: _COLUMN_DTYPES[column] for header, column in HEADERS.items()}
+TEXT_DTYPES = {header: 'str' if dtype.startswith('int') else dtype for header, dtype in DTYPES.items()}
+
+CATEGORY_COLUMNS = [column for column, _, dtype in COLUMNS if dtype == 'category']
+
+# Integer columns -> their dtype, and the text columns holding timestamps (see parse_timestamps)
+INTEGER_COLUMNS = {column: dtype for column, _, dtype in COLUMNS if dtype.startswith('int')}
+TIMESTAMP_COLUMNS = ['scheduledday', 'appointmentday']
+
+
+def conform(df):
+    """
+    Rename the columns of a frame of the feed to the landing columns, in their order, dropping unknown
+    ones, and give Gender and Neighbourhood their categorical dtype. Raises ValueError when a column is missing.
+    """
+    df = df.rename(columns=HEADERS)
+    missing = [column for column in LANDING_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}.")
+    df = df[LANDING_COLUMNS]
+    for column in CATEGORY_COLUMNS:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df = df.assign(**{column: df[column].astype('category')})
+    return df
+
+
+def typed(df):
+    """
+    Give the columns of a frame of the feed (headers in any spelling) their declared types, as written to
+    typed partitions: integers become nullable integers of their dtype and timestamps naive UTC datetimes
+    (microseconds). Values that do not fit the type become missing, so validation still rejects their rows.
+    Other columns are left as they are.
+    """
+    casts = {}
+    for header in df.columns:
+        column = HEADERS.get(header)
+        if column in INTEGER_COLUMNS:
+            casts[header] = parse_integers(df[header], INTEGER_COLUMNS[column])
+        elif column in TIMESTAMP_COLUMNS:
+            casts[header] = parse_timestamps(df[header]).astype('datetime64[us]')
+    return df.assign(**casts)
+
+
+def _read_csv(file_path, dtypes, **kwargs):
+    return pd.read_csv(file_path, usecols=lambda header: header in HEADERS, dtype=dtypes, **kwargs)
+
+
+def read_csv(file_path):
+    """
+    Read a whole CSV file of the feed with the declared dtypes, as landing columns.
+    """
+    try:
+        df = _read_csv(file_path, DTYPES)
+    except (ValueError, TypeError) as e:
+        logging.warning(f"{file_path} has values that do not fit the declared types ({e}); "
+                        f"reading its integer columns as text.")
+        df = _read_csv(file_path, TEXT_DTYPES)
+    return conform(df)
+
+
+def iter_csv(file_path, chunk_rows):
+    """
+    Read a CSV file of the feed with the declared dtypes in chunks of chunk_rows rows, as landing columns.
+    """
+    rows_read = 0
+    with _read_csv(file_path, DTYPES, chunksize=chunk_rows) as reader:
+        while True:
+            try:
+                chunk = next(reader)
+            except StopIteration:
+                return
+            except (ValueError, TypeError) as e:
+                logging.warning(f"{file_path} has values that do not fit the declared types ({e}); "
+                                f"reading it on from row {rows_read} with its integer columns as text.")
+                break
+            rows_read += len(chunk)
+            yield conform(chunk)
+
+    # Start over with the integers read as text and skip the rows already handed out
+    for chunk in _read_csv(file_path, TEXT_DTYPES, chunksize=chunk_rows):
+        if rows_read >= len(chunk):
+            rows_read -= len(chunk)
+            continue
+        yield conform(chunk.iloc[rows_read:])
+        rows_read = 0
+
+
+def parse_timestamps(values):
+    """
+    Parse a column of ISO 8601 timestamps (2016-04-29T18:38:08Z) into naive UTC datetimes, the values of a
+    TIMESTAMP column. Values in other formats are parsed one by one; unparseable values become NaT.
+    Columns already holding datetimes (typed partitions) are only made naive UTC.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.tz_convert(None) if values.dt.tz is not None else values
+    parsed = pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True)
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], format='mixed', errors='coerce', utc=True)
+    return parsed.dt.tz_convert(None)
+
+
+def parse_integers(values, dtype):
+    """
+    Parse a column of integers (read as numbers or as text) into nullable integers of dtype ('int32' or
+    'int64'). Non-numeric values, fractions and values out of the range of dtype become <NA>. A column
+    already read with dtype is returned as it is.
+    """
+    if values.dtype == dtype:
+        return values
+    if not pd.api.types.is_numeric_dtype(values):
+        # Text that is all integers within range converts directly, several times faster than to_numeric;
+        # anything else raises (unlike floats, which astype would truncate)
+        try:
+            return values.astype(dtype)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    numbers = pd.to_numeric(values, errors='coerce')
+    limits = np.iinfo(dtype)
+    fits = (numbers % 1 == 0) & numbers.between(limits.min, limits.max)
+    return numbers.where(fits).astype(dtype.capitalize())
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+# Seconds a catalog snapshot is used before it is reloaded
+CATALOG_TTL = 300
+
+# A name missing from the snapshot triggers a reload, at most this often (seconds),
+# so a table created since the last load is found without waiting for the TTL
+MISS_RELOAD_INTERVAL = 5
+
+# Relations listed by the API: tables, partitioned tables, views, materialized views, foreign tables
+RELATION_KINDS = ['r', 'p', 'v', 'm', 'f']
+
+# Default of SchemaCatalog.refresh: reload whatever snapshot is current
+_ANY = object()
+
+
+class TableInfo:
+    """Columns (name -> type), primary key and indexed columns of one table."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.columns = {}
+        self.primary_key = []
+        self.indexed_columns = set()  # columns leading at least one index
+
+    def resolve_column(self, name):
+        """
+        Return the column name as stored, matching exactly first and then case-insensitively
+        (unquoted names in SQL fold to lower case); None when the table has no such column.
+        """
+        if name in self.columns:
+            return name
+        if name.lower() in self.columns:
+            return name.lower()
+        return None
+
+
+class CatalogSnapshot:
+    """Schemas and tables of a database as read at loaded_at."""
+
+    def __init__(self, schemas, loaded_at):
+        self.schemas = schemas  # schema -> table -> TableInfo
+        self.loaded_at = loaded_at
+        self.loaded_monotonic = time.monotonic()
+
+    def tables(self, schema):
+        return list(self.schemas.get(schema, {}))
+
+    def table(self, schema, table):
+        return self.schemas.get(schema, {}).get(table)
+
+
+async def load_snapshot(conn):
+    """
+    Read schemas, tables, columns, primary keys and indexes from pg_catalog in three queries.
+    """
+    schemas = {}
+    relations = await conn.fetch("""
+        SELECT c.oid, n.nspname, c.relname, c.relkind::text AS relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind::text = ANY($1::text[])
+          AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+          AND n.nspname NOT LIKE 'pg\\_%'
+        ORDER BY n.nspname, c.relname
+    """, RELATION_KINDS)
+    by_oid = {}
+    for relation in relations:
+        info = TableInfo(relation["relkind"])
+        schemas.setdefault(relation["nspname"], {})[relation["relname"]] = info
+        by_oid[relation["oid"]] = info
+
+    columns = await conn.fetch("""
+        SELECT a.attrelid, a.attname, format_type(a.atttypid, a.atttypmod) AS type_name
+        FROM pg_attribute a
+        WHERE a.attrelid = ANY($1::oid[]) AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attrelid, a.attnum
+    """, list(by_oid))
+    for column in columns:
+        by_oid[column["attrelid"]].columns[column["attname"]] = column["type_name"]
+
+    indexes = await conn.fetch("""
+        SELECT i.indrelid, i.indisprimary,
+               array_agg(a.attname ORDER BY array_position(i.indkey::int2[], a.attnum)) AS columns
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = ANY($1::oid[])
+        GROUP BY i.indexrelid, i.indrelid, i.indisprimary
+    """, list(by_oid))
+    for index in indexes:
+        info = by_oid[index["indrelid"]]
+        info.indexed_columns.add(index["columns"][0])
+        if index["indisprimary"]:
+            info.primary_key = list(index["columns"])
+
+    return CatalogSnapshot(schemas, datetime.now())
+
+
+class SchemaCatalog:
+    """
+    In-process cache of the catalog of one database, reloaded after ttl seconds or on demand.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL, acquire_timeout=None):
+        self.ttl = ttl
+        self.acquire_timeout = acquire_timeout
+        self._snapshot = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, pool):
+        """
+        Return the current snapshot, loading it with a connection from pool when missing or expired.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_monotonic > self.ttl:
+            snapshot = await self.refresh(pool, stale=snapshot)
+        return snapshot
+
+    async def refresh(self, pool, stale=_ANY):
+        """
+        Reload the snapshot. When stale is given and another caller already replaced it, that
+        newer snapshot is returned instead of loading again.
+        """
+        async with self._lock:
+            if stale is not _ANY and self._snapshot is not stale:
+                return self._snapshot
+            async with pool.acquire(timeout=self.acquire_timeout) as conn:
+                self._snapshot = await load_snapshot(conn)
+            table_count = sum(len(tables) for tables in self._snapshot.schemas.values())
+            logging.info(f"Catalog loaded: {len(self._snapshot.schemas)} schemas, {table_count} tables.")
+            return self._snapshot
+
+    async def find_table(self, pool, schema, table):
+        """
+        Return (snapshot, TableInfo or None), reloading once when the table is missing from a
+        snapshot older than MISS_RELOAD_INTERVAL.
+        """
+        snapshot = await self.get(pool)
+        info = snapshot.table(schema, table)
+        if info is None and time.monotonic() - snapshot.loaded_monotonic > MISS_RELOAD_INTERVAL:
+            snapshot = await self.refresh(pool, stale=snapshot)
+            info = snapshot.table(schema, table)
+        return snapshot, info
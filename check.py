@@ -1,29 +1,17 @@
-import psycopg2
 from sqlalchemy import create_engine
 
+from database import DB_CONFIGS, check_health, close_all_pools
+
 # Database configuration
-DB_CONFIG = {
-    'user': 'postgres',
-    'password': 'postgres',
-    'host': 'localhost',
-    'port': '5432',
-    'dbname': 'hospital',
-    'schema': 'LANDING_LAYER'
-}
+DB_CONFIG = DB_CONFIGS['hospital']
 
-# psycopg2 Connection Test
-try:
-    conn = psycopg2.connect(
-        dbname=DB_CONFIG['dbname'],
-        user=DB_CONFIG['user'],
-        password=DB_CONFIG['password'],
-        host=DB_CONFIG['host'],
-        port=DB_CONFIG['port']
-    )
-    print("psycopg2 connected to PostgreSQL from WSL!")
-    conn.close()
-except Exception as e:
-    print(f"psycopg2 connection failed: {e}")
+# psycopg2 Connection Test, through the shared connection pools
+for dbname in DB_CONFIGS:
+    if check_health(dbname):
+        print(f"psycopg2 connected to PostgreSQL database '{dbname}' from WSL!")
+    else:
+        print(f"psycopg2 connection to '{dbname}' failed, see the log for details.")
+close_all_pools()
 
 # SQLAlchemy Engine Test
 try:
@@ -35,4 +23,4 @@ try:
     with engine.connect() as conn:
         print("SQLAlchemy connected to PostgreSQL from WSL!")
 except Exception as e:
-    print(f"SQLAlchemy connection failed: {e}")
\ No newline at end of file
+    print(f"SQLAlchemy connection failed: {e}")
@@ -0,0 +1,223 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+# Connection details for every database used by the pipeline
+DB_CONFIGS = {
+    'hospital': {
+        'host': 'localhost',
+        'port': '5432',
+        'dbname': 'hospital',
+        'user': 'postgres',
+        'password': 'postgres'
+    },
+    'core': {
+        'host': 'localhost',
+        'port': '5432',
+        'dbname': 'core',
+        'user': 'postgres',
+        'password': 'postgres'
+    }
+}
+
+# Pool size for each database
+POOL_SIZES = {
+    'hospital': {'minconn': 1, 'maxconn': 8},
+    'core': {'minconn': 1, 'maxconn': 10}
+}
+
+# Session parameters set once, when a pooled connection is opened, for each kind of session.
+# Landing sessions skip waiting for the WAL flush on commit: the landing layer is reloaded from
+# the source files anyway, so losing the last commits on a server crash is acceptable there.
+SESSION_SETTINGS = {
+    'default': {'application_name': 'datapipeline'},
+    'landing': {'application_name': 'src_to_lnd', 'statement_timeout': '0', 'synchronous_commit': 'off'},
+    'lnd_to_core': {'application_name': 'lnd_to_core', 'statement_timeout': '0'},
+    'api': {'application_name': 'retrieve_data_api', 'statement_timeout': '30s'}
+}
+
+# A pooled connection idle for longer than this is checked with SELECT 1 before it is handed out
+HEALTH_CHECK_INTERVAL = 30  # seconds
+
+# Seconds a caller of an asyncio pool waits for a free connection before giving up
+ACQUIRE_TIMEOUT = 10
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of connections to one database, opened with one set of session parameters.
+    getconn blocks while all maxconn connections are in use instead of failing.
+    """
+
+    def __init__(self, dbname, profile='default'):
+        settings = dict(SESSION_SETTINGS[profile])
+        application_name = settings.pop('application_name', 'datapipeline')
+        options = ' '.join(f'-c {name}={value}' for name, value in settings.items())
+
+        sizes = POOL_SIZES.get(dbname, {'minconn': 1, 'maxconn': 5})
+        self.dbname = dbname
+        self.profile = profile
+        self._slots = threading.BoundedSemaphore(sizes['maxconn'])
+        self._last_used = {}
+        self._pool = pool.ThreadedConnectionPool(
+            sizes['minconn'],
+            sizes['maxconn'],
+            application_name=application_name,
+            options=options,
+            **DB_CONFIGS[dbname]
+        )
+        logging.info(f"Connection pool for {dbname} ({profile}) created with {sizes['minconn']}-{sizes['maxconn']} "
+                     f"connections and session settings {SESSION_SETTINGS[profile]}.")
+
+    def getconn(self, timeout=None):
+        """
+        Borrow a healthy connection, waiting up to timeout seconds (forever when None) for a free one.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise pool.PoolError(f"Timed out waiting for a connection to {self.dbname}.")
+        try:
+            while True:
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                logging.warning(f"Discarding broken connection to {self.dbname}.")
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """
+        Return a connection to the pool, rolling back any transaction left open by the caller.
+        """
+        try:
+            close = bool(conn.closed)
+            if not close and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """
+        Close every connection of the pool.
+        """
+        self._pool.closeall()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+def get_pool(dbname, profile='default'):
+    """
+    Return the shared pool for a database and session profile, creating it on first use.
+    """
+    key = (dbname, profile)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(dbname, profile)
+        return _pools[key]
+
+
+@contextmanager
+def get_connection(dbname, profile='default', timeout=None):
+    """
+    Borrow a connection from the shared pool for the duration of a with block.
+    The caller commits; anything left uncommitted is rolled back when the connection is returned.
+    """
+    connection_pool = get_pool(dbname, profile)
+    conn = connection_pool.getconn(timeout)
+    try:
+        yield conn
+    finally:
+        connection_pool.putconn(conn)
+
+
+def check_health(dbname, profile='default'):
+    """
+    Return True when a pooled connection to the database answers SELECT 1.
+    """
+    try:
+        with get_connection(dbname, profile, timeout=5) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                return cursor.fetchone()[0] == 1
+    except Exception as e:
+        logging.error(f"Health check for {dbname} failed: {e}")
+        return False
+
+
+def close_all_pools():
+    """
+    Close every pool opened by this process.
+    """
+    with _pools_lock:
+        for connection_pool in _pools.values():
+            connection_pool.closeall()
+        _pools.clear()
+
+
+async def create_async_pool(dbname, profile='default', min_size=None, max_size=None):
+    """
+    Open an asyncpg pool to a database, for asyncio code such as the API.
+    Sizes default to POOL_SIZES; connections get the session parameters of the profile.
+    The caller owns the pool and closes it with await pool.close().
+    """
+    # Imported here so the batch scripts, which only use psycopg2, do not need asyncpg installed
+    import asyncpg
+
+    sizes = POOL_SIZES.get(dbname, {'minconn': 1, 'maxconn': 5})
+    min_size = sizes['minconn'] if min_size is None else min_size
+    max_size = sizes['maxconn'] if max_size is None else max_size
+    config = DB_CONFIGS[dbname]
+    connection_pool = await asyncpg.create_pool(
+        host=config['host'],
+        port=int(config['port']),
+        database=config['dbname'],
+        user=config['user'],
+        password=config['password'],
+        min_size=min_size,
+        max_size=max_size,
+        server_settings=SESSION_SETTINGS[profile]
+    )
+    logging.info(f"Async connection pool for {dbname} ({profile}) created with {min_size}-{max_size} "
+                 f"connections and session settings {SESSION_SETTINGS[profile]}.")
+    return connection_pool
+
+
+def _forget_pools_after_fork():
+    # A forked worker must never use (or close) the sockets it inherited from its parent
+    global _pools, _pools_lock
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools_after_fork)
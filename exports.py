@@ -0,0 +1,164 @@
+import asyncio
+
+from metrics import current_timings
+from serialization import column_types, dumps, row_encoder
+
+# Streamed formats of /retrieve-data, with their media type and file extension
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+
+# Rows per Arrow record batch (and Parquet row group)
+ARROW_BATCH_ROWS = 50000
+
+# COPY output chunks buffered ahead of a slow client before the COPY is paused
+COPY_QUEUE_CHUNKS = 64
+
+
+def require_pyarrow():
+    """
+    Import pyarrow, which is only needed for the parquet and arrow formats.
+    Raises ImportError when it is not installed.
+    """
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pyarrow
+
+
+def arrow_schema(attributes):
+    """
+    Arrow schema for the columns of a prepared statement (statement.get_attributes()).
+    NUMERIC is sent as its exact decimal text: a double would round it, and the result columns carry
+    no precision and scale for a decimal128 (PatientId is an unconstrained NUMERIC). Other types
+    without an Arrow counterpart are sent as strings too.
+    """
+    pa = require_pyarrow()
+    types = {
+        'bool': pa.bool_(),
+        'int2': pa.int16(),
+        'int4': pa.int32(),
+        'int8': pa.int64(),
+        'float4': pa.float32(),
+        'float8': pa.float64(),
+        'numeric': pa.string(),
+        'text': pa.string(),
+        'varchar': pa.string(),
+        'bpchar': pa.string(),
+        'name': pa.string(),
+        'date': pa.date32(),
+        'timestamp': pa.timestamp('us'),
+        'timestamptz': pa.timestamp('us', tz='UTC'),
+    }
+    return pa.schema([pa.field(attribute.name, types.get(attribute.type.name, pa.string()))
+                      for attribute in attributes])
+
+
+async def arrow_batches(statement, params, schema, batch_rows=ARROW_BATCH_ROWS):
+    """
+    Read the rows of a prepared statement from a server-side cursor as Arrow record batches.
+    Must run inside a transaction.
+    """
+    pa = require_pyarrow()
+    # pyarrow does not turn Decimals (NUMERIC) or other objects into strings itself, nor Decimals into doubles
+    converters = [str if field.type == pa.string() else float if pa.types.is_floating(field.type) else None
+                  for field in schema]
+    timings = current_timings()
+    cursor = await statement.cursor(*params)
+    while True:
+        rows = await cursor.fetch(batch_rows)
+        if not rows:
+            break
+        columns = []
+        for index, field in enumerate(schema):
+            values = [row[index] for row in rows]
+            convert = converters[index]
+            if convert is not None:
+                values = [None if value is None else convert(value) for value in values]
+            columns.append(pa.array(values, type=field.type))
+        timings.rows += len(rows)
+        yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class _ChunkSink:
+    """Write-only file object collecting what a pyarrow writer produces, to be sent as it comes."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def stream_arrow(statement, params, file_format):
+    """
+    Send the rows of a prepared statement as a Parquet file or an Arrow IPC stream, one record
+    batch at a time. Must run inside a transaction.
+    """
+    pa = require_pyarrow()
+    schema = arrow_schema(statement.get_attributes())
+    sink = _ChunkSink()
+    if file_format == 'parquet':
+        writer = pa.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    async for batch in arrow_batches(statement, params, schema):
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+async def stream_ndjson(statement, params, prefetch):
+    """
+    Send the rows of a prepared statement as NDJSON. Must run inside a transaction.
+    """
+    timings = current_timings()
+    encode_row = row_encoder(column_types(statement.get_attributes()))
+    async for row in statement.cursor(*params, prefetch=prefetch):
+        timings.rows += 1
+        yield dumps(encode_row(row)) + b"\n"
+
+
+async def stream_copy_csv(conn, query, params):
+    """
+    Send the result of a query as CSV with a header, produced by PostgreSQL itself (COPY ... TO STDOUT).
+    """
+    chunks = asyncio.Queue(maxsize=COPY_QUEUE_CHUNKS)
+
+    async def copy():
+        try:
+            await conn.copy_from_query(query, *params, output=chunks.put, format='csv', header=True)
+        finally:
+            await chunks.put(None)
+
+    task = asyncio.create_task(copy())
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            yield bytes(chunk)
+        # Raises the COPY error, if that is what ended the stream
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
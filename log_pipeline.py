@@ -0,0 +1,167 @@
+import atexit
+import json
+import logging
+import multiprocessing.util
+import os
+import queue
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+# Records buffered between the logging call and the file; when the buffer is full new records
+# are dropped (and counted) rather than making the caller wait for the disk
+LOG_QUEUE_SIZE = 10000
+
+# "json" writes one JSON object per line instead of the text format of the entry point
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
+# Per-row errors: the first ROW_ERRORS_FIRST are logged, then one in ROW_ERRORS_EVERY,
+# and never more than ROW_ERRORS_PER_SECOND a second
+ROW_ERRORS_FIRST = 10
+ROW_ERRORS_EVERY = 1000
+ROW_ERRORS_PER_SECOND = 10
+
+# Attributes every LogRecord has; anything else was passed through extra= and goes into the JSON line
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never waits: a record that does not fit in the queue is dropped and counted,
+    and the count is reported as soon as the queue has room again.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def enqueue(self, record):
+        try:
+            if self._unreported:
+                self.queue.put_nowait(logging.LogRecord(
+                    record.name, logging.WARNING, __file__, 0,
+                    f"Log queue full: {self._unreported} records dropped.", None, None))
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+
+
+class LogPipeline:
+    """A bounded queue fed by the logging calls and a listener thread writing it to the log file."""
+
+    def __init__(self, file_handler, queue_size):
+        self.file_handler = file_handler
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.listener = None
+
+    def start(self):
+        self.listener = QueueListener(self.handler.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Write out every queued record and stop the listener thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.file_handler.flush()
+
+    def _after_fork(self):
+        # A forked worker process inherits the queue but not the listener thread: give it its own
+        # queue and listener, flushed when the worker exits
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.listener = None
+        self.start()
+        multiprocessing.util.Finalize(self, LogPipeline.stop, args=(self,), exitpriority=0)
+
+
+_pipeline = None
+
+
+def configure_logging(log_file_path, fmt, level=logging.INFO, json_logs=None, queue_size=LOG_QUEUE_SIZE):
+    """
+    Send the records of the root logger to log_file_path through a bounded queue and a listener
+    thread, so logging calls never block on file I/O. Records are formatted with fmt, or as JSON
+    lines when json_logs is true (by default when the LOG_FORMAT environment variable is "json").
+    Returns the LogPipeline; it is stopped, flushing the queue, when the process exits.
+    """
+    global _pipeline
+    if json_logs is None:
+        json_logs = LOG_FORMAT == "json"
+    file_handler = logging.FileHandler(log_file_path)
+    file_handler.setFormatter(JsonFormatter() if json_logs else logging.Formatter(fmt))
+
+    if _pipeline is not None:
+        _pipeline.stop()
+    _pipeline = LogPipeline(file_handler, queue_size)
+    _pipeline.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_pipeline.handler)
+    root.setLevel(level)
+
+    atexit.register(_pipeline.stop)
+    multiprocessing.util.register_after_fork(_pipeline, LogPipeline._after_fork)
+    return _pipeline
+
+
+class RowErrorLog:
+    """
+    Rate-limited, sampled logging of per-row errors: the first `first` errors are logged, then one
+    in `every`, and never more than `per_second` a second. summary() logs how many were left out.
+    """
+
+    def __init__(self, what, first=ROW_ERRORS_FIRST, every=ROW_ERRORS_EVERY, per_second=ROW_ERRORS_PER_SECOND):
+        self.what = what
+        self.first = first
+        self.every = every
+        self.per_second = per_second
+        self.seen = 0
+        self.suppressed = 0
+        self._tokens = float(per_second)
+        self._refilled = time.monotonic()
+
+    def allow(self):
+        """
+        Count one error and tell whether to log it; callers build the message only when it is logged.
+        """
+        self.seen += 1
+        if self.seen > self.first and self.seen % self.every:
+            self.suppressed += 1
+            return False
+        now = time.monotonic()
+        self._tokens = min(float(self.per_second), self._tokens + (now - self._refilled) * self.per_second)
+        self._refilled = now
+        if self._tokens < 1:
+            self.suppressed += 1
+            return False
+        self._tokens -= 1
+        return True
+
+    def summary(self):
+        if self.suppressed:
+            logging.warning(f"{self.what}: {self.seen} in total, {self.suppressed} not logged individually.")
@@ -0,0 +1,75 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded or does not belong to the query."""
+
+
+def quote_ident(name):
+    """
+    Quote an SQL identifier, doubling any embedded double quote.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _encode_value(value):
+    # Tag every key value with its type, so it is bound with the same type when the cursor comes back
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return ['bool', value]
+    if isinstance(value, int):
+        return ['int', value]
+    if isinstance(value, Decimal):
+        return ['dec', str(value)]
+    if isinstance(value, datetime):
+        return ['ts', value.isoformat()]
+    if isinstance(value, date):
+        return ['date', value.isoformat()]
+    if isinstance(value, float):
+        return ['float', value]
+    return ['str', str(value)]
+
+
+def _decode_value(tagged):
+    if tagged is None:
+        return None
+    kind, value = tagged
+    if kind in ('bool', 'int', 'float', 'str'):
+        return value
+    if kind == 'dec':
+        return Decimal(value)
+    if kind == 'ts':
+        return datetime.fromisoformat(value)
+    if kind == 'date':
+        return date.fromisoformat(value)
+    raise InvalidCursor(f"Unknown key type {kind!r}.")
+
+
+def encode_cursor(key_columns, key_values):
+    """
+    Build the opaque token pointing just after the row whose key_columns hold key_values.
+    """
+    payload = {'c': list(key_columns), 'k': [_encode_value(value) for value in key_values]}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, key_columns):
+    """
+    Return the key values stored in a token, checking it was issued for the same key_columns.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        columns, values = payload['c'], [_decode_value(value) for value in payload['k']]
+    except InvalidCursor:
+        raise
+    except Exception:
+        raise InvalidCursor("Malformed cursor.")
+    if columns != list(key_columns) or len(values) != len(columns):
+        raise InvalidCursor("Cursor was issued for a different order_by.")
+    return values
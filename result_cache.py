@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+# Table the ETL bumps in every transaction that changes a table of the core database
+GENERATION_SCHEMA = 'FINAL_LAYER'
+GENERATION_TABLE = 'load_generation'
+
+# Defaults of the result cache: entries kept, total size of their bodies, seconds an entry is trusted
+CACHE_ENTRIES = 256
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL = 60
+
+
+class Freshness:
+    """Version of a table's data: token changes whenever the data does."""
+
+    def __init__(self, token, last_modified):
+        self.token = token
+        self.last_modified = last_modified  # aware datetime, or None when unknown
+
+    def etag(self, key):
+        digest = hashlib.sha1(repr((key, self.token)).encode()).hexdigest()
+        return f'"{digest}"'
+
+    def http_last_modified(self):
+        if self.last_modified is None:
+            return None
+        return format_datetime(self.last_modified.astimezone(timezone.utc), usegmt=True)
+
+
+async def probe_freshness(conn, snapshot, schema, table):
+    """
+    Cheaply find the current version of a table: its load generation, one indexed lookup. Returns None
+    for tables the ETL keeps no generation for, whose results are then not cached: anything else
+    telling a change (row count, latest UPDT_DB_TS) would scan the table on every request.
+    """
+    if snapshot.table(GENERATION_SCHEMA, GENERATION_TABLE) is None:
+        return None
+    row = await conn.fetchrow(f"""
+        SELECT Generation, UPDT_DB_TS::timestamptz AS updated_at
+        FROM "{GENERATION_SCHEMA}".{GENERATION_TABLE}
+        WHERE SchemaName = $1 AND TableName = $2
+    """, schema, table)
+    if row is None:
+        return None
+    return Freshness(('generation', row['generation']), row['updated_at'])
+
+
+def not_modified(request_headers, etag, freshness):
+    """
+    True when the client's copy (If-None-Match, or else If-Modified-Since) is still current.
+    """
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = request_headers.get('if-modified-since')
+    if if_modified_since and freshness.last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            # A -0000 zone parses to a naive datetime; HTTP dates are in GMT
+            since = since.replace(tzinfo=timezone.utc)
+        return freshness.last_modified.replace(microsecond=0) <= since
+    return False
+
+
+class CacheEntry:
+    def __init__(self, body, headers, token, rows):
+        self.body = body
+        self.headers = headers
+        self.token = token
+        self.rows = rows
+        self.stored_at = time.monotonic()
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of rendered response bodies, keyed on the normalized query.
+    An entry is served only while younger than ttl and stored under the current freshness token.
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, token):
+        entry = self._entries.get(key)
+        if entry is None or entry.token != token or time.monotonic() - entry.stored_at > self.ttl:
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, token, body, headers, rows=0):
+        # A body taking more than a quarter of the budget would evict most of the cache for one entry
+        if self.max_entries <= 0 or len(body) > self.max_bytes // 4:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(body, headers, token, rows)
+        self._bytes += len(body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        logging.info("Result cache cleared.")
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
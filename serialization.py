@@ -0,0 +1,64 @@
+import json
+from decimal import Decimal
+
+import orjson
+from fastapi.encoders import decimal_encoder, jsonable_encoder
+
+# Converters applied per column before a row is written, by PostgreSQL type name. orjson writes the
+# other common types (bool, integers, floats, text, date, timestamp, uuid) itself, the way
+# jsonable_encoder and json.dumps would, except for floats: exponents are written without a sign
+# or padding (1e16, 1.5e-7 rather than 1e+16, 1.5e-07) and NaN and infinities, which are not valid
+# JSON, as null. NUMERIC becomes an int or a float as in FastAPI.
+COLUMN_CONVERTERS = {
+    'numeric': decimal_encoder,
+}
+
+
+def _default(value):
+    # Values orjson cannot write (Decimals inside arrays, intervals, ...) get FastAPI's encoding
+    if isinstance(value, Decimal):
+        return decimal_encoder(value)
+    return jsonable_encoder(value)
+
+
+def column_types(attributes):
+    """
+    (name, type name) of every column of a prepared statement (statement.get_attributes()).
+    """
+    return [(attribute.name, attribute.type.name) for attribute in attributes]
+
+
+def row_encoder(columns):
+    """
+    Build a function turning one result row (asyncpg Record or tuple) into a dict for dumps().
+    The converter of every column is looked up once here, from columns as given by column_types(),
+    so encoding a row only touches the values that need converting.
+    """
+    names = [name for name, _ in columns]
+    converters = [(index, COLUMN_CONVERTERS[type_name]) for index, (_, type_name) in enumerate(columns)
+                  if type_name in COLUMN_CONVERTERS]
+    if not converters:
+        return lambda row: dict(zip(names, row))
+
+    def encode(row):
+        values = list(row)
+        for index, convert in converters:
+            value = values[index]
+            if value is not None:
+                values[index] = convert(value)
+        return dict(zip(names, values))
+
+    return encode
+
+
+def dumps(payload) -> bytes:
+    """
+    Serialize a response payload to compact UTF-8 JSON, as JSONResponse would but several times faster.
+    Floats in exponent notation and non-finite floats are spelled differently (see COLUMN_CONVERTERS).
+    """
+    try:
+        return orjson.dumps(payload, default=_default)
+    except orjson.JSONEncodeError:
+        # Integers beyond 64 bits (large NUMERIC values) are only written by the json module, which
+        # spells the floats of such a payload its own way (1e+16, NaN)
+        return json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,99 @@
+import argparse
+import gc
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from serialization import dumps, row_encoder
+
+# Microbenchmark of the JSON body of /retrieve-data: the previous path (a dict per row, then
+# jsonable_encoder and json.dumps) against serialization.py (per-column converters and orjson),
+# on synthetic rows with the columns and types of "FINAL_LAYER".pat_attendance_core.
+#
+#   python serialization_benchmark.py --rows 10000,100000,1000000
+
+# Columns of pat_attendance_core as (name, type name), as column_types() reports them
+COLUMNS = [
+    ('patientid', 'numeric'), ('appointmentid', 'int8'), ('gender', 'bpchar'), ('scheduledday', 'timestamp'),
+    ('appointmentday', 'timestamp'), ('age', 'int4'), ('neighbourhood', 'varchar'), ('scholarshipstatus', 'bool'),
+    ('hipertensionstatus', 'bool'), ('diabetesstatus', 'bool'), ('alcoholismstatus', 'bool'),
+    ('handcapstatus', 'bool'), ('smsreceivedstatus', 'bool'), ('noshow', 'bool'), ('recordstartdate', 'timestamp'),
+    ('recordenddate', 'timestamp'), ('isactive', 'bool'), ('cr_db_ts', 'timestamp'), ('updt_db_ts', 'timestamp'),
+    ('rowhash', 'bpchar'),
+]
+
+ROW_COUNTS = [10000, 100000, 1000000]
+
+
+def synthetic_rows(count):
+    """
+    count result tuples shaped like pat_attendance_core rows, a third of them closed-out history.
+    """
+    scheduled = datetime(2016, 4, 29, 18, 38, 8)
+    loaded = datetime(2025, 1, 28, 0, 45, 15, 123456)
+    neighbourhoods = ['JARDIM DA PENHA', 'MATA DA PRAIA', 'SANTO ANDRÉ', 'CENTRO', 'ITARARÉ']
+    rows = []
+    for i in range(count):
+        active = i % 3 != 0
+        rows.append((
+            Decimal(29872499824296 + i * 7919), 5642903 + i, 'F' if i % 2 else 'M',
+            scheduled + timedelta(seconds=i), scheduled.replace(hour=0, minute=0, second=0), i % 100,
+            neighbourhoods[i % len(neighbourhoods)], i % 10 == 0, i % 5 == 0, i % 13 == 0, i % 31 == 0,
+            i % 50 == 0, i % 3 == 0, i % 4 == 0, loaded, None if active else loaded + timedelta(days=1),
+            active, loaded, loaded, f'{i:032x}',
+        ))
+    return rows
+
+
+def current_path(rows):
+    names = [name for name, _ in COLUMNS]
+    data = [dict(zip(names, row)) for row in rows]
+    return json.dumps(jsonable_encoder({"data": data}), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(rows):
+    encode_row = row_encoder(COLUMNS)
+    return dumps({"data": [encode_row(row) for row in rows]})
+
+
+def best_time(serialize, rows, repeat):
+    """
+    Best wall time of repeat runs of serialize(rows), and the body it produced.
+    """
+    best = None
+    body = None
+    for _ in range(repeat):
+        body = None
+        gc.collect()
+        start = time.perf_counter()
+        body = serialize(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the JSON serialization paths of /retrieve-data.")
+    parser.add_argument('--rows', default=','.join(str(count) for count in ROW_COUNTS),
+                        help="comma-separated row counts (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per path and row count, best kept (default: 1)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"{'rows':>9} {'current s':>10} {'fast s':>8} {'speed-up':>9} {'current rows/s':>15} {'fast rows/s':>12} {'MB':>7}")
+    for count in [int(value) for value in args.rows.split(',')]:
+        rows = synthetic_rows(count)
+        current_seconds, current_body = best_time(current_path, rows, args.repeat)
+        fast_seconds, fast_body = best_time(fast_path, rows, args.repeat)
+        # The synthetic rows hold no floats in exponent notation nor non-finite ones, which the two
+        # paths spell differently (see serialization.py), so their bodies must match byte for byte
+        if fast_body != current_body:
+            raise SystemExit(f"The two paths produced different bodies for {count} rows.")
+        print(f"{count:>9} {current_seconds:>10.3f} {fast_seconds:>8.3f} {current_seconds / fast_seconds:>8.1f}x "
+              f"{count / current_seconds:>15,.0f} {count / fast_seconds:>12,.0f} {len(fast_body) / 1e6:>7.1f}")
+        del rows, current_body, fast_body